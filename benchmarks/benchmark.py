@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import resource
+import functools
+import tracemalloc
+import collections
+import importlib.util
+import importlib.machinery
+
+import numpy
+
+from bokeh.document import Document
+
+# benchmark the working tree rather than an installed version
+REPOSITORY = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+sys.path.insert(0,REPOSITORY)
+
+import spav.data
+import spav.utils
+
+from synthetic_data import generate_dataset
+
+# the functions of spav_prepare_data whose time is reported separately;
+# the rest of generate_data_files is reported as 'other'
+PREPARE_STAGES = [('read_sample_files','posterior samples'),
+                  ('registration','registration'),
+                  ('read_aar_matrix','annotations'),
+                  ('build_thumbnail','thumbnails'),
+                  ('build_tile_pyramid','tile pyramids')]
+
+VIEWS = collections.OrderedDict([
+  ('ExpressionOnArrays',lambda dataset,static_directory: spav.utils.ExpressionOnArrays(dataset,static_directory)),
+  ('ExpressionOnArray',lambda dataset,static_directory: spav.utils.ExpressionOnArray(dataset,static_directory)),
+  ('ExpressionInCommonCoordinate',lambda dataset,static_directory: spav.utils.ExpressionInCommonCoordinate(dataset)),
+  ('AARExpressionCoefficients',lambda dataset,static_directory: spav.utils.AARExpressionCoefficients(dataset)),
+  ('LevelExpressionCoefficients',lambda dataset,static_directory: spav.utils.LevelExpressionCoefficients(dataset))])
+
+def peak_memory():
+  # ru_maxrss is in kilobytes on Linux
+  return {'main process': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0,
+          'worker processes': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/1024.0}
+
+def load_prepare_script():
+  filename = os.path.join(REPOSITORY,'bin','spav_prepare_data')
+  loader = importlib.machinery.SourceFileLoader('spav_prepare_data',filename)
+  module = importlib.util.module_from_spec(importlib.util.spec_from_loader(loader.name,loader))
+  # the worker processes look up the functions by the module name
+  sys.modules[loader.name] = module
+  loader.exec_module(module)
+  return module
+
+class StageTimer:
+  def __init__(self):
+    self.timings = collections.OrderedDict()
+
+  def add(self,stage,elapsed):
+    self.timings[stage] = self.timings.get(stage,0)+elapsed
+
+  def wrap(self,stage,function):
+    @functools.wraps(function)
+    def wrapper(*args,**kwargs):
+      start = time.perf_counter()
+      try:
+        return function(*args,**kwargs)
+      finally:
+        self.add(stage,time.perf_counter()-start)
+    return wrapper
+
+  def wrap_generator(self,stage,function):
+    # only the time spent producing the items is counted
+    @functools.wraps(function)
+    def wrapper(*args,**kwargs):
+      iterator = iter(function(*args,**kwargs))
+      while True:
+        start = time.perf_counter()
+        try:
+          item = next(iterator)
+        except StopIteration:
+          return
+        finally:
+          self.add(stage,time.perf_counter()-start)
+        yield item
+    return wrapper
+
+def benchmark_prepare(dataset_directory,server_directory,jobs):
+  prepare = load_prepare_script()
+
+  timer = StageTimer()
+  for function,stage in PREPARE_STAGES:
+    if function == 'read_sample_files':
+      setattr(prepare,function,timer.wrap_generator(stage,getattr(prepare,function)))
+    else:
+      setattr(prepare,function,timer.wrap(stage,getattr(prepare,function)))
+
+  # the paths in the metadata are relative to the dataset directory
+  working_directory = os.getcwd()
+  os.chdir(dataset_directory)
+  try:
+    start = time.perf_counter()
+    prepare.generate_data_files('data','output',server_directory,copy=True,jobs=jobs)
+    total = time.perf_counter()-start
+  finally:
+    os.chdir(working_directory)
+
+  timings = collections.OrderedDict((stage,timer.timings.get(stage,0.0)) for _,stage in PREPARE_STAGES)
+  timings['other'] = total-sum(timings.values())
+  timings['total'] = total
+
+  return {'timings': timings,
+          'data_file_size': os.path.getsize(os.path.join(server_directory,'data','data.hdf5')),
+          'peak_memory': peak_memory()}
+
+def benchmark_view(data_filename,view_name,genes):
+  # every view gets its own dataset so that the caches are cold
+  start = time.perf_counter()
+  dataset = spav.data.Dataset(data_filename)
+  open_time = time.perf_counter()-start
+
+  start = time.perf_counter()
+  view = VIEWS[view_name](dataset,'static')
+  document = Document()
+  document.add_root(view.layout)
+  construction_time = time.perf_counter()-start
+
+  document_size = len(document.to_json_string())
+
+  # the initial gene of the view has been loaded already and selecting it
+  # again does not trigger a switch
+  genes = [gene for gene in genes if gene != view.gene]
+
+  # without a server session the gene switches are applied synchronously
+  switch_times = {}
+  for cache in ['cold','warm']:
+    switch_times[cache] = []
+    for gene in genes:
+      start = time.perf_counter()
+      view.textinput_gene.value = gene
+      switch_times[cache].append(time.perf_counter()-start)
+
+  dataset.close()
+
+  return {'open': open_time,
+          'construction': construction_time,
+          'document_size': document_size,
+          'switch_cold_median': float(numpy.median(switch_times['cold'])),
+          'switch_warm_median': float(numpy.median(switch_times['warm'])),
+          'switch_max': float(numpy.max(switch_times['cold']+switch_times['warm'])),
+          'peak_memory': view_peak_memory(data_filename,view_name,genes)}
+
+def view_peak_memory(data_filename,view_name,genes):
+  # the peak of the memory allocated while opening the dataset, constructing
+  # the view and switching the genes; ru_maxrss is the maximum so far of the
+  # whole process, so the allocations are traced in a separate run (tracing
+  # slows down the code being timed)
+  tracemalloc.start()
+  try:
+    dataset = spav.data.Dataset(data_filename)
+    view = VIEWS[view_name](dataset,'static')
+    document = Document()
+    document.add_root(view.layout)
+    document.to_json_string()
+    for gene in genes:
+      view.textinput_gene.value = gene
+    dataset.close()
+    return tracemalloc.get_traced_memory()[1]/1024.0**2
+  finally:
+    tracemalloc.stop()
+
+def print_results(results,baseline=None):
+  # the changes relative to the baseline are shown in parentheses
+  def format_value(value,baseline_value,unit,scale):
+    text = '%.3f %s'%(value*scale,unit)
+    if baseline_value:
+      text += ' (%+.0f%%)'%(100*(value/baseline_value-1))
+    return text
+
+  def baseline_value(*keys):
+    value = baseline
+    for key in keys:
+      if not isinstance(value,dict) or key not in value:
+        return None
+      value = value[key]
+    return value
+
+  print('spav_prepare_data')
+  for stage,value in results['prepare']['timings'].items():
+    print('  %-28s %s'%(stage,format_value(value,baseline_value('prepare','timings',stage),'s',1)))
+  print('  %-28s %.1f MiB'%('data file',results['prepare']['data_file_size']/1024.0**2))
+  print('  %-28s %.1f MiB (workers %.1f MiB)'%('peak memory',results['prepare']['peak_memory']['main process'],
+                                               results['prepare']['peak_memory']['worker processes']))
+
+  for view,view_results in results['views'].items():
+    print(view)
+    for key in ['open','construction','switch_cold_median','switch_warm_median','switch_max']:
+      print('  %-28s %s'%(key.replace('_',' '),format_value(view_results[key],baseline_value('views',view,key),'ms',1000)))
+    print('  %-28s %.1f KiB'%('document size',view_results['document_size']/1024.0))
+    print('  %-28s %.1f MiB'%('peak memory (traced)',view_results['peak_memory']))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='A script for benchmarking Spav on synthetic data')
+  parser.add_argument('-d','--dataset-directory',action='store',dest='dataset_directory',type=str,required=False,
+                      help='directory of a dataset generated by synthetic_data.py (a new dataset is generated by default)')
+  parser.add_argument('-o','--output',action='store',dest='output',type=str,required=False,
+                      help='write the results as JSON')
+  parser.add_argument('-b','--baseline',action='store',dest='baseline',type=str,required=False,
+                      help='compare the timings with earlier results written using --output')
+  parser.add_argument('-j','--jobs',action='store',dest='jobs',type=int,required=False,
+                      help='number of processes used by spav_prepare_data')
+  parser.add_argument('--switches',action='store',dest='switches',type=int,required=False,
+                      help='number of gene switches per view')
+  parser.add_argument('--genes',action='store',dest='genes',type=int,required=False,
+                      help='number of genes')
+  parser.add_argument('--arrays',action='store',dest='arrays',type=int,required=False,
+                      help='number of arrays')
+  parser.add_argument('--spots',action='store',dest='spots',type=int,required=False,
+                      help='number of spots per array')
+  parser.add_argument('--draws',action='store',dest='draws',type=int,required=False,
+                      help='number of posterior draws')
+  parser.add_argument('--aars',action='store',dest='aars',type=int,required=False,
+                      help='number of AARs')
+  parser.add_argument('--level-1',action='store',dest='level_1',type=int,required=False,
+                      help='number of level 1 variables')
+  parser.add_argument('--image-size',action='store',dest='image_size',type=int,required=False,
+                      help='edge of the images in pixels')
+
+  parser.set_defaults(jobs=1,switches=10,genes=50,arrays=4,spots=300,draws=100,aars=3,level_1=2,image_size=2000)
+  options = parser.parse_args()
+
+  work_directory = tempfile.mkdtemp(prefix='spav_benchmark_')
+  try:
+    parameters = vars(options).copy()
+    if options.dataset_directory is None:
+      dataset_directory = os.path.join(work_directory,'dataset')
+      start = time.perf_counter()
+      generate_dataset(dataset_directory,options.genes,options.arrays,options.spots,options.draws,
+                       options.aars,options.level_1,options.image_size)
+      print('Generated the synthetic dataset in %.1f s'%(time.perf_counter()-start))
+    else:
+      dataset_directory = os.path.abspath(options.dataset_directory)
+
+    server_directory = os.path.join(work_directory,'server')
+    results = {'parameters': parameters,'prepare': benchmark_prepare(dataset_directory,server_directory,options.jobs),'views': {}}
+
+    data_filename = os.path.join(server_directory,'data','data.hdf5')
+    dataset = spav.data.Dataset(data_filename)
+    genes = dataset.genes
+    dataset.close()
+    # the views start with the first gene
+    genes = [genes[idx] for idx in numpy.unique(numpy.linspace(1,len(genes)-1,min(options.switches,len(genes)-1)).astype(int))]
+    for view in VIEWS:
+      try:
+        results['views'][view] = benchmark_view(data_filename,view,genes)
+      except Exception as exception:
+        raise RuntimeError('Benchmarking the view %s failed: %s'%(view,exception)) from exception
+  finally:
+    shutil.rmtree(work_directory)
+
+  baseline = None
+  if options.baseline is not None:
+    with open(options.baseline) as f:
+      baseline = json.load(f)
+
+  print_results(results,baseline)
+
+  if options.output is not None:
+    with open(options.output,'w') as f:
+      json.dump(results,f,indent=2)
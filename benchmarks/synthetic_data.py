@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+import os
+import pickle
+import argparse
+
+import numpy
+import pandas as pd
+
+from PIL import Image
+Image.MAX_IMAGE_PIXELS = 1000000000
+
+# the spots of the Spatial Transcriptomics arrays are on a 33 x 35 grid
+ARRAY_GRID = (33,35)
+
+# Splotch writes the posterior samples of 100 genes per directory
+GENES_PER_DIRECTORY = 100
+
+def generate_image(filename,size,rng):
+  # a smooth background with noise so that the images compress and
+  # downscale roughly like bright-field images
+  background = Image.fromarray(rng.integers(96,256,(16,16,3)).astype(numpy.uint8)).resize((size,size),Image.BILINEAR)
+  noise = Image.effect_noise((size,size),48).convert('RGB')
+  Image.blend(background,noise,0.25).save(filename,quality=90)
+
+def generate_spots(n_spots,rng):
+  # a contiguous tissue section, i.e. the grid positions closest to a random
+  # center, with the small offsets of the aligned spot coordinates; the grid
+  # is subdivided when there are more spots than grid positions
+  subdivision = max(int(numpy.ceil(numpy.sqrt(n_spots/(ARRAY_GRID[0]*ARRAY_GRID[1])))),1)
+  x,y = numpy.meshgrid(1+numpy.arange(ARRAY_GRID[0]*subdivision)/subdivision,1+numpy.arange(ARRAY_GRID[1]*subdivision)/subdivision)
+  x,y = x.ravel(),y.ravel()
+  center = rng.uniform(0.3,0.7,2)*ARRAY_GRID
+  order = numpy.argsort((x-center[0])**2+(y-center[1])**2)[:n_spots]
+  x,y = x[order]+rng.normal(0,0.05/subdivision,n_spots),y[order]+rng.normal(0,0.05/subdivision,n_spots)
+
+  # the relative distances of the spots from the center
+  ranks = numpy.arange(n_spots)/n_spots
+
+  # the coordinates identify the spots, so they need more digits on a finer grid
+  digits = 2+int(numpy.ceil(numpy.log10(subdivision)))
+  return ['%.*f_%.*f'%(digits,spot_x,digits,spot_y) for spot_x,spot_y in zip(x,y)],ranks
+
+def write_stan_csv(filename,log_lambda,beta_level_1):
+  # CmdStan output: comment lines, a header and one row per draw;
+  # the matrices are flattened in column-major order
+  n_draws = log_lambda.shape[0]
+  columns = ['lp__']
+  columns += ['log_lambda.%d'%(spot+1) for spot in range(log_lambda.shape[1])]
+  columns += ['beta_level_1.%d.%d'%(level_1+1,aar+1) for aar in range(beta_level_1.shape[2]) for level_1 in range(beta_level_1.shape[1])]
+  values = numpy.hstack([numpy.zeros((n_draws,1)),log_lambda,beta_level_1.transpose(0,2,1).reshape(n_draws,-1)])
+
+  with open(filename,'w') as f:
+    f.write('# synthetic posterior samples\n')
+    f.write('# num_samples = %d\n'%(n_draws))
+    numpy.savetxt(f,values,fmt='%.4g',delimiter=',',header=','.join(columns),comments='')
+
+def generate_dataset(directory,n_genes=50,n_arrays=4,n_spots=300,n_draws=100,n_aars=3,n_level_1=2,image_size=2000,seed=0):
+  # the file paths in the metadata are relative to directory, which has to be
+  # the working directory when running spav_prepare_data
+  rng = numpy.random.default_rng(seed)
+
+  os.makedirs(os.path.join(directory,'data'),exist_ok=True)
+  os.makedirs(os.path.join(directory,'output'),exist_ok=True)
+
+  genes = ['Gene%05d'%(gene_idx) for gene_idx in range(n_genes)]
+  aar_names = ['AAR%d'%(aar_idx) for aar_idx in range(n_aars)]
+  level_1_names = ['Condition%d'%(level_1_idx) for level_1_idx in range(n_level_1)]
+
+  metadata = []
+  filenames_and_coordinates = []
+  spot_level_1 = []
+  spot_aar = []
+  for array_idx in range(n_arrays):
+    count_file = os.path.join('data','array_%d.tsv'%(array_idx))
+    annotation_file = os.path.join('data','array_%d_annotations.tsv'%(array_idx))
+    image_file = os.path.join('data','array_%d.jpg'%(array_idx))
+    level_1 = level_1_names[array_idx%n_level_1]
+
+    # the spots are annotated to the AARs in concentric rings
+    coordinates,ranks = generate_spots(n_spots,rng)
+    aars = numpy.minimum((ranks*n_aars).astype(int),n_aars-1)
+
+    pd.DataFrame((aars[None,:] == numpy.arange(n_aars)[:,None]).astype(int),
+                 index=aar_names,columns=coordinates).to_csv(os.path.join(directory,annotation_file),sep='\t')
+    pd.DataFrame(rng.poisson(5,(n_genes,len(coordinates))),
+                 index=genes,columns=coordinates).to_csv(os.path.join(directory,count_file),sep='\t')
+    generate_image(os.path.join(directory,image_file),image_size,rng)
+
+    metadata.append({'Name': 'array_%d'%(array_idx),'Level 1': level_1,
+                     'Count file': count_file,'Annotation file': annotation_file,'Image file': image_file})
+    filenames_and_coordinates += [(count_file,coordinate) for coordinate in coordinates]
+    spot_level_1 += len(coordinates)*[array_idx%n_level_1]
+    spot_aar += list(aars)
+
+  spot_level_1 = numpy.array(spot_level_1)
+  spot_aar = numpy.array(spot_aar)
+
+  pickle.dump({'genes': genes,
+               'metadata': pd.DataFrame(metadata),
+               'n_levels': 1,
+               'annotation_mapping': aar_names,
+               'scaling_factor': 1.0,
+               'beta_mapping': {'beta_level_1': level_1_names},
+               'filenames_and_coordinates': filenames_and_coordinates},
+              open(os.path.join(directory,'data','information.p'),'wb'))
+
+  for gene_idx in range(n_genes):
+    # the expressions of the spots follow the coefficients of their
+    # level 1 variables and AARs
+    beta_mean = rng.normal(0,1.5,(n_level_1,n_aars))
+    beta_sd = rng.uniform(0.1,0.5,(n_level_1,n_aars))
+    beta_level_1 = rng.normal(beta_mean,beta_sd,(n_draws,n_level_1,n_aars))
+    spot_mean = beta_mean[spot_level_1,spot_aar]+rng.normal(0,0.3,len(spot_aar))
+    log_lambda = rng.normal(spot_mean,0.2,(n_draws,len(spot_aar)))
+
+    gene_directory = os.path.join(directory,'output','%d'%(gene_idx//GENES_PER_DIRECTORY))
+    os.makedirs(gene_directory,exist_ok=True)
+    write_stan_csv(os.path.join(gene_directory,'combined_%d.csv'%(gene_idx+1)),log_lambda,beta_level_1)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='A script for generating synthetic Splotch inputs and outputs')
+  parser.add_argument('-o','--directory',action='store',dest='directory',type=str,required=True,
+                      help='output directory')
+  parser.add_argument('--genes',action='store',dest='genes',type=int,required=False,
+                      help='number of genes')
+  parser.add_argument('--arrays',action='store',dest='arrays',type=int,required=False,
+                      help='number of arrays')
+  parser.add_argument('--spots',action='store',dest='spots',type=int,required=False,
+                      help='number of spots per array')
+  parser.add_argument('--draws',action='store',dest='draws',type=int,required=False,
+                      help='number of posterior draws')
+  parser.add_argument('--aars',action='store',dest='aars',type=int,required=False,
+                      help='number of AARs')
+  parser.add_argument('--level-1',action='store',dest='level_1',type=int,required=False,
+                      help='number of level 1 variables')
+  parser.add_argument('--image-size',action='store',dest='image_size',type=int,required=False,
+                      help='edge of the images in pixels')
+  parser.add_argument('--seed',action='store',dest='seed',type=int,required=False,
+                      help='random seed')
+
+  parser.set_defaults(genes=50,arrays=4,spots=300,draws=100,aars=3,level_1=2,image_size=2000,seed=0)
+  options = parser.parse_args()
+
+  generate_dataset(options.directory,options.genes,options.arrays,options.spots,options.draws,
+                   options.aars,options.level_1,options.image_size,options.seed)
@@ -2,6 +2,7 @@
 
 import os
 import sys
+import html
 
 import argparse
 
@@ -9,6 +10,7 @@ import bokeh.io
 import bokeh.layouts
 import bokeh.models
 
+import spav.data
 import spav.utils
 
 import argparse
@@ -36,35 +38,109 @@ parser.set_defaults(level_coefficients=False)
 
 options = parser.parse_args()
 
-tab_list = []
+# the datasets are data/<name>.hdf5 and they are opened on demand (see server_lifecycle.py)
+registry = spav.data.get_registry(os.path.join(os.path.dirname(__file__),'data'))
+static_root = os.path.join(os.path.basename(os.path.dirname(__file__)),'static')
 
-data_filename = os.path.join(os.path.dirname(__file__),'data/data.hdf5')
-static_directory = os.path.join(os.path.basename(os.path.dirname(__file__)),'static')
+# the panels of the common coordinate view with more spots in view are rasterized
+common_coordinate_spots = int(os.environ.get('SPAV_COMMON_COORDINATE_SPOTS',20000))
 
-if options.arrays:
-  view = spav.utils.ExpressionOnArrays(data_filename,static_directory)
-  tab_list.append(bokeh.models.widgets.Panel(child=view.layout,title='Expression on arrays'))
+def create_tabs(dataset):
+  views = []
 
-if options.array:
-  view = spav.utils.ExpressionOnArray(data_filename,static_directory)
-  tab_list.append(bokeh.models.widgets.Panel(child=view.layout,title='Expression on array'))
+  static_directory = os.path.join(static_root,dataset.static_subdirectory)
 
-if options.common_coordinate:
-  view = spav.utils.ExpressionInCommonCoordinate(data_filename)
-  tab_list.append(bokeh.models.widgets.Panel(child=view.layout,title='Expression in common coordinate'))
+  if options.arrays:
+    views.append(('Expression on arrays',lambda: spav.utils.ExpressionOnArrays(dataset,static_directory)))
 
-if options.level_coefficients:
-  view = spav.utils.LevelExpressionCoefficients(data_filename)
-  tab_list.append(bokeh.models.widgets.Panel(child=view.layout,title='Expression coefficients per variable'))
+  if options.array:
+    views.append(('Expression on array',lambda: spav.utils.ExpressionOnArray(dataset,static_directory)))
 
-if options.aar_coefficients:
-  view = spav.utils.AARExpressionCoefficients(data_filename)
-  tab_list.append(bokeh.models.widgets.Panel(child=view.layout,title='Expression coefficients per AAR'))
+  if options.common_coordinate:
+    views.append(('Expression in common coordinate',lambda: spav.utils.ExpressionInCommonCoordinate(dataset,max_spots=common_coordinate_spots)))
 
-if len(tab_list) > 0:
-  bokeh.core.validation.silence(bokeh.core.validation.warnings.MISSING_RENDERERS,True)
-  bokeh.io.curdoc().add_root(bokeh.models.widgets.Tabs(tabs=tab_list))
-  bokeh.io.curdoc().title = 'Spav'
-else:
+  if options.level_coefficients:
+    views.append(('Expression coefficients per variable',lambda: spav.utils.LevelExpressionCoefficients(dataset)))
+
+  if options.aar_coefficients:
+    views.append(('Expression coefficients per AAR',lambda: spav.utils.AARExpressionCoefficients(dataset)))
+
+  # the tabs are placeholders until they are shown for the first time
+  tabs = bokeh.models.widgets.Tabs(tabs=[bokeh.models.widgets.Panel(child=bokeh.models.widgets.Div(text='<b>Please wait.</b>'),title=title)
+                                         for title,_ in views])
+  built = set()
+
+  def build_view(idx):
+    if idx in built:
+      return
+    title,create_view = views[idx]
+    # the placeholder shows the error and the view is built again when the tab is shown again
+    try:
+      layout = create_view().layout
+    except Exception as exception:
+      logging.exception('Creating the view %s failed'%(title))
+      tabs.tabs[idx].child.text = '<b>The view could not be created: %s</b>'%(html.escape(str(exception)))
+      return
+    built.add(idx)
+    tabs.tabs[idx] = bokeh.models.widgets.Panel(child=layout,title=title)
+
+  tabs.on_change('active',lambda attr,old,new: build_view(new))
+  build_view(tabs.active)
+
+  return tabs
+
+if not any([options.arrays,options.array,options.common_coordinate,options.level_coefficients,options.aar_coefficients]):
   logging.warning('No views were specified!')
   sys.exit(0)
+
+document = bokeh.io.curdoc()
+
+# the dataset of the session is released when the session is destroyed
+session = {'dataset': None}
+
+def select_dataset(name):
+  dataset = registry.acquire(name)
+  if session['dataset'] is not None:
+    registry.release(session['dataset'])
+  session['dataset'] = name
+  return dataset
+
+def release_dataset(session_context):
+  if session['dataset'] is not None:
+    registry.release(session['dataset'])
+    session['dataset'] = None
+
+document.on_session_destroyed(release_dataset)
+
+names = registry.names()
+
+# the dataset can be selected using the URL argument dataset
+name = None
+if document.session_context is not None and document.session_context.request is not None:
+  arguments = document.session_context.request.arguments
+  if 'dataset' in arguments and arguments['dataset'][0].decode('UTF-8') in names:
+    name = arguments['dataset'][0].decode('UTF-8')
+if name is None and len(names) == 1:
+  name = names[0]
+
+bokeh.core.validation.silence(bokeh.core.validation.warnings.MISSING_RENDERERS,True)
+document.title = 'Spav'
+
+if len(names) == 0:
+  logging.warning('No datasets were found!')
+  document.add_root(bokeh.models.widgets.Div(text='<b>No datasets were found!</b>'))
+elif len(names) == 1:
+  document.add_root(create_tabs(select_dataset(name)))
+else:
+  # a picker for switching between the datasets
+  select_dataset_widget = bokeh.models.widgets.Select(value=name or '',options=['']+names,title='Dataset:',width=300)
+  layout = bokeh.layouts.column(select_dataset_widget,create_tabs(select_dataset(name)) if name is not None else bokeh.models.widgets.Div(text=''))
+
+  def update_dataset(attr,old,new):
+    if new == '':
+      return
+    layout.children[1] = create_tabs(select_dataset(new))
+
+  select_dataset_widget.on_change('value',update_dataset)
+
+  document.add_root(layout)
@@ -0,0 +1,23 @@
+import os
+
+import spav.data
+import spav.instrumentation
+
+def on_server_loaded(server_context):
+  # the datasets are opened when the first session requests them and the
+  # sessions share them; the datasets without sessions are closed when they
+  # have been idle for a while or when they take too much memory
+  registry = spav.data.get_registry(os.path.join(os.path.dirname(__file__),'data'),
+                                    idle_timeout=float(os.environ.get('SPAV_DATASET_IDLE_TIMEOUT',1800)),
+                                    max_bytes=int(os.environ['SPAV_DATASET_MEMORY']) if 'SPAV_DATASET_MEMORY' in os.environ else None,
+                                    expression_cache_size=int(os.environ.get('SPAV_EXPRESSION_CACHE_SIZE',256*1024**2)),
+                                    density_cache_size=int(os.environ.get('SPAV_DENSITY_CACHE_SIZE',64*1024**2)),
+                                    prefetch_size=int(os.environ.get('SPAV_PREFETCH_GENES',16)))
+
+  server_context.add_periodic_callback(registry.evict,60*1000)
+
+  # the timings of the views are served on a separate port when requested
+  if 'SPAV_METRICS_PORT' in os.environ:
+    spav.instrumentation.enable()
+    spav.instrumentation.metrics.add_gauge('spav_datasets',registry.stats)
+    spav.instrumentation.start_metrics_server(int(os.environ['SPAV_METRICS_PORT']))
@@ -29,6 +29,6 @@ setup(name='Spav',
           'License :: OSI Approved :: BSD 3-Clause "New" or "Revised" License (BSD-3-Clause)',
           'Programming Language :: Python :: 3'],
       packages=['spav'],
-      scripts=['bin/spav_prepare_data'],
+      scripts=['bin/spav_prepare_data','bin/spav_render'],
       install_requires=install_requires,
 )
@@ -0,0 +1,593 @@
+import os
+import mmap
+import glob
+import time
+import logging
+import threading
+import contextlib
+import collections
+import concurrent.futures
+
+import numpy
+import h5py
+
+from spav.density import support_points
+from spav.search import GeneSearchIndex
+from spav.instrumentation import metrics
+
+def decode(values):
+  return list(map(lambda x: x.decode('UTF-8'),list(values)))
+
+def read_string(dset):
+  # h5py 3 reads the strings as bytes
+  value = dset[()]
+  return value.decode('UTF-8') if isinstance(value,bytes) else value
+
+def read_only(array,dtype=None):
+  # arrays of the right type (e.g. views of the memory maps) are not copied
+  array = numpy.asarray(array,dtype=dtype)
+  array.flags.writeable = False
+  return array
+
+def map_dataset(dset):
+  # a read-only memory map of an uncompressed contiguous dataset so that the
+  # processes reading the same file share the page cache and the reads are
+  # views; None if the dataset is chunked or it has not been allocated
+  if dset.chunks is not None or dset.size == 0 or dset.dtype.kind not in 'iuf':
+    return None
+
+  offset = dset.id.get_offset()
+  if offset is None:
+    return None
+
+  return numpy.memmap(dset.file.filename,mode='r',dtype=dset.dtype,shape=dset.shape,offset=offset)
+
+def resident_nbytes(array):
+  # the number of bytes of the array in the memory of the process; the
+  # views of the memory maps are in the page cache shared by the processes
+  base = array
+  while base is not None:
+    if isinstance(base,(numpy.memmap,mmap.mmap)):
+      return 0
+    base = getattr(base,'base',None)
+
+  return array.nbytes
+
+def read_dataset(dset,dtype=None):
+  memory_map = map_dataset(dset)
+  return read_only(dset if memory_map is None else memory_map,dtype)
+
+def read_tiles(image_grp):
+  # data files prepared without the tile pyramids refer only to the images
+  if 'tile_directory' not in image_grp:
+    return None
+
+  return {'directory': read_string(image_grp['tile_directory']),
+          'tile_size': int(numpy.array(image_grp['tile_size'])),
+          'n_levels': int(numpy.array(image_grp['tile_levels']))}
+
+def read_thumbnail(image_grp):
+  if 'thumbnail_filename' not in image_grp:
+    return None
+
+  return {'filename': read_string(image_grp['thumbnail_filename']),
+          'scale': read_only(image_grp['thumbnail_scale'])}
+
+class GeneExpressions:
+  # the expressions of a gene on all the arrays concatenated (in single
+  # precision) and the 95th percentile used as the maximum of the color scale
+  def __init__(self,expressions,offsets,vmax=None):
+    self.expressions = read_only(expressions,numpy.float32)
+    self.offsets = offsets
+    if vmax is None:
+      with metrics.timer('spav_data_seconds',operation='percentile'):
+        vmax = numpy.percentile(self.expressions,95)
+    self.vmax = vmax
+    self.nbytes = self.expressions.nbytes
+    self.resident_nbytes = resident_nbytes(self.expressions)
+
+  def array(self,array):
+    start,end = self.offsets[array]
+    return self.expressions[start:end]
+
+class GeneDensity:
+  # the evaluation points (points or points x beta x aar), the densities
+  # (points x beta x aar) and the maxima of the densities (beta x aar) of a gene
+  def __init__(self,points,values,density_max=None):
+    self.points = read_only(points)
+    self.values = read_only(values)
+    self.density_max = None if density_max is None else read_only(density_max)
+    self.nbytes = self.points.nbytes+self.values.nbytes+(0 if self.density_max is None else self.density_max.nbytes)
+    self.resident_nbytes = resident_nbytes(self.points)+resident_nbytes(self.values)+(0 if self.density_max is None else resident_nbytes(self.density_max))
+
+class LRUCache:
+  # a thread-safe least recently used cache limited by the total size
+  # of the entries in bytes (the entries have to have the attribute nbytes
+  # and they can have the attribute resident_nbytes if they are not in memory);
+  # the readers of an entry that is being loaded wait for the running load
+  def __init__(self,max_bytes):
+    self.max_bytes = max_bytes
+    self.nbytes = 0
+    self.resident_nbytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.waits = 0
+    self.evictions = 0
+
+    self.__entries = collections.OrderedDict()
+    self.__loading = {}
+    self.__lock = threading.Lock()
+
+  def __contains__(self,key):
+    # whether the entry is cached or being loaded
+    with self.__lock:
+      return key in self.__entries or key in self.__loading
+
+  def get(self,key,load):
+    with self.__lock:
+      if key in self.__entries:
+        self.hits += 1
+        self.__entries.move_to_end(key)
+        return self.__entries[key]
+      if key in self.__loading:
+        self.waits += 1
+        future = self.__loading[key]
+      else:
+        self.misses += 1
+        future = None
+        self.__loading[key] = concurrent.futures.Future()
+
+    if future is not None:
+      return future.result()
+
+    # do not block the other readers while loading
+    try:
+      entry = load(key)
+    except BaseException as exception:
+      with self.__lock:
+        self.__loading.pop(key).set_exception(exception)
+      raise
+
+    with self.__lock:
+      self.__loading.pop(key).set_result(entry)
+      if key not in self.__entries and entry.nbytes <= self.max_bytes:
+        self.__entries[key] = entry
+        self.nbytes += entry.nbytes
+        self.resident_nbytes += getattr(entry,'resident_nbytes',entry.nbytes)
+        while self.nbytes > self.max_bytes:
+          _,evicted = self.__entries.popitem(last=False)
+          self.nbytes -= evicted.nbytes
+          self.resident_nbytes -= getattr(evicted,'resident_nbytes',evicted.nbytes)
+          self.evictions += 1
+
+    return entry
+
+  def stats(self):
+    with self.__lock:
+      return {'entries': len(self.__entries),'nbytes': self.nbytes,'resident_nbytes': self.resident_nbytes,'max_bytes': self.max_bytes,
+              'hits': self.hits,'misses': self.misses,'waits': self.waits,'evictions': self.evictions}
+
+class Prefetcher:
+  # loads the genes that are likely to be selected next (the completions
+  # shown to the user and the genes viewed after the selected one) into the
+  # caches in a background thread; at most max_pending genes are queued and
+  # the most recent requests are loaded first and replace the oldest ones;
+  # nothing is prefetched while the views are loading genes
+  def __init__(self,dataset,max_pending=16,max_successors=3):
+    self.dataset = dataset
+    self.max_pending = max_pending
+    self.max_successors = max_successors
+    self.prefetched = 0
+    self.closed = False
+
+    self.__pending = collections.OrderedDict()
+    self.__foreground_loads = 0
+    self.__successors = {}
+    self.__condition = threading.Condition()
+    self.__thread = None
+
+  def __cache(self,kind):
+    return self.dataset.expression_cache if kind == 'expressions' else self.dataset.density_cache
+
+  def prefetch(self,genes,kind):
+    if self.max_pending <= 0 or self.closed:
+      return
+
+    with self.__condition:
+      # the first genes are inserted last so that they are loaded first
+      for gene in reversed(genes):
+        if gene not in self.dataset.gene_index or gene in self.__cache(kind):
+          continue
+        self.__pending.pop((kind,gene),None)
+        self.__pending[(kind,gene)] = None
+      while len(self.__pending) > self.max_pending:
+        self.__pending.popitem(last=False)
+
+      if len(self.__pending) == 0:
+        return
+
+      if self.__thread is None:
+        self.__thread = threading.Thread(target=self.__run,name='spav-prefetch',daemon=True)
+        self.__thread.start()
+      self.__condition.notify()
+
+  def record(self,previous,gene,kind):
+    # count the genes selected after each gene (in all the sessions) and
+    # prefetch the most common successors of the selected gene
+    if gene not in self.dataset.gene_index:
+      return
+
+    with self.__condition:
+      if previous in self.dataset.gene_index and previous != gene:
+        successors = self.__successors.setdefault(previous,collections.Counter())
+        successors[gene] += 1
+        if len(successors) > 4*self.max_successors:
+          self.__successors[previous] = collections.Counter(dict(successors.most_common(self.max_successors)))
+      genes = [successor for successor,_ in self.__successors.get(gene,collections.Counter()).most_common(self.max_successors)]
+
+    self.prefetch(genes,kind)
+
+  @contextlib.contextmanager
+  def foreground(self):
+    # the prefetching waits until the loads of the views have finished
+    with self.__condition:
+      self.__foreground_loads += 1
+    try:
+      yield
+    finally:
+      with self.__condition:
+        self.__foreground_loads -= 1
+        self.__condition.notify()
+
+  def close(self):
+    with self.__condition:
+      self.closed = True
+      self.__pending.clear()
+      self.__condition.notify()
+
+  def __run(self):
+    while True:
+      with self.__condition:
+        while (len(self.__pending) == 0 or self.__foreground_loads > 0) and not self.closed:
+          self.__condition.wait()
+        if self.closed:
+          return
+        (kind,gene),_ = self.__pending.popitem()
+
+      try:
+        with metrics.timer('spav_data_seconds',operation='prefetch_%s'%(kind)):
+          if kind == 'expressions':
+            self.dataset.get_expressions(gene,prefetch=True)
+          else:
+            self.dataset.get_density(gene,prefetch=True)
+        self.prefetched += 1
+      except Exception as exception:
+        logging.warning('Prefetching %s of %s failed: %s'%(kind,gene,exception))
+
+class Dataset:
+  # the contents of data.hdf5 shared by all the sessions and views;
+  # everything except the expressions and the densities is read once
+  # and should be treated as read-only
+  def __init__(self,filename,expression_cache_size=256*1024**2,density_cache_size=64*1024**2,prefetch_size=16):
+    self.filename = filename
+
+    self.__lock = threading.Lock()
+    self.__file = h5py.File(self.filename,'r')
+    self.__expressions_map,self.__density_map = self.__map_datasets()
+
+    # the images of the dataset relative to the static directory of the server
+    self.static_subdirectory = self.__file.attrs.get('static_subdirectory','')
+
+    self.genes = self.__read_genes()
+    self.gene_index = {gene: idx for idx,gene in enumerate(self.genes)}
+    self.gene_aliases = self.__read_gene_aliases()
+    self.search_index = GeneSearchIndex(self.genes,self.gene_aliases)
+    self.arrays = self.__read_array_data()
+    self.annotation_names = self.__encode_annotations()
+    self.spot_offsets = self.__read_spot_offsets()
+    self.__rows_in_order = self.__rows_in_array_order()
+    self.level_1_variables,self.level_1_arrays = self.__read_level_data()
+    self.evaluation_points,self.density_limits,self.beta_variables,self.aar_names = self.__read_beta_data()
+    self.lambda_statistics,self.summary_level_1 = self.__read_summary_data()
+
+    self.expression_cache = LRUCache(expression_cache_size)
+    self.density_cache = LRUCache(density_cache_size)
+    self.prefetcher = Prefetcher(self,prefetch_size)
+
+  def __map_datasets(self):
+    expressions_map = map_dataset(self.__file['expressions']) if 'expressions' in self.__file else None
+    density = self.__file['beta']['density']
+    density_map = map_dataset(density) if isinstance(density,h5py.Dataset) else None
+
+    return expressions_map,density_map
+
+  def __read_genes(self):
+    return decode(self.__file['genes'])
+
+  def __read_gene_aliases(self):
+    # data files prepared without the aliases
+    if 'gene_aliases' not in self.__file:
+      return {}
+
+    aliases = self.__file['gene_aliases']
+    return dict(zip(decode(aliases['aliases']),decode(aliases['genes'])))
+
+  def __read_array_data(self):
+    data = {}
+    for array in self.__file['arrays']:
+      array_grp = self.__file['arrays'][array]
+      data[array] = {'coordinates': read_dataset(array_grp['data']['coordinates'],numpy.float32),
+                     'registered_coordinates': read_dataset(array_grp['data']['registered_coordinates'],numpy.float32),
+                     'annotations': decode(numpy.array(array_grp['data']['annotations'])),
+                     'spot_radius': float(numpy.array(array_grp['image']['spot_radius'])),
+                     'resolution': read_only(array_grp['image']['resolution']),
+                     'title': read_string(array_grp['image']['title']),
+                     'filename': read_string(array_grp['image']['filename']),
+                     'tiles': read_tiles(array_grp['image']),
+                     'thumbnail': read_thumbnail(array_grp['image'])}
+
+    return data
+
+  def __encode_annotations(self):
+    # the annotations of the spots as indices to the sorted annotation names
+    names = sorted(set(annotation for array in self.arrays.values() for annotation in array['annotations']))
+    dtype = numpy.uint8 if len(names) <= 256 else numpy.uint16
+    for array in self.arrays.values():
+      array['annotation_codes'] = read_only(numpy.searchsorted(names,array['annotations']),dtype)
+
+    return names
+
+  def __read_spot_offsets(self):
+    # data files prepared before the genes x spots matrix was introduced
+    # store one dataset per gene per array
+    if 'expressions' not in self.__file:
+      return None
+
+    return {array: tuple(numpy.array(self.__file['arrays'][array]['data']['spot_offsets'])) for array in self.__file['arrays']}
+
+  def __read_level_data(self,key='level_1'):
+    variables = list(self.__file[key].keys())
+    arrays = {variable: decode(self.__file['%s/%s'%(key,variable)]['files']) for variable in variables}
+
+    return variables,arrays
+
+  def __read_beta_data(self):
+    # data files prepared before the per-gene supports evaluate the
+    # densities of all the genes on the same points
+    if 'support' in self.__file['beta']:
+      density_evaluation_points = None
+      density_limits = tuple(numpy.array(self.__file['beta']['density_limits']))
+    else:
+      density_evaluation_points = read_only(self.__file['beta']['density_evaluation_points'])
+      density_limits = (density_evaluation_points.min(),density_evaluation_points.max())
+    variables = decode(self.__file['beta']['beta_variables'])
+    aar_names = decode(self.__file['beta']['aar_names'])
+
+    return density_evaluation_points,density_limits,variables,aar_names
+
+  def __read_summary_data(self):
+    # data files prepared without the summary statistics
+    if 'summary' not in self.__file:
+      return None,None
+
+    return decode(self.__file['summary']['lambda_statistics']),decode(self.__file['summary']['level_1'])
+
+  def read_lambda_summary(self,gene,level_1=None):
+    # the summary statistics of the expressions of the gene on all the
+    # arrays or on the arrays of the given level 1 group
+    if self.lambda_statistics is None:
+      return None
+
+    with self.__lock:
+      if level_1 is None:
+        values = self.__file['summary']['lambda'][self.gene_index[gene],:]
+      else:
+        values = self.__file['summary']['lambda_level_1'][self.gene_index[gene],self.summary_level_1.index(level_1),:]
+
+    return dict(zip(self.lambda_statistics,values))
+
+  def read_density_max(self,gene):
+    # the maxima of the densities of the beta variables (beta x aar)
+    if self.lambda_statistics is None:
+      return None
+
+    with self.__lock:
+      return self.__file['summary']['density_max'][self.gene_index[gene],:,:]
+
+  def __read_expression_row(self,gene):
+    with metrics.timer('spav_data_seconds',operation='read_expressions'):
+      # the rows of the memory map are views and they do not need the lock
+      if self.__expressions_map is not None:
+        return self.__expressions_map[self.gene_index[gene]]
+
+      with self.__lock:
+        return self.__file['expressions'][self.gene_index[gene],:]
+
+  def read_expressions(self,gene):
+    if self.spot_offsets is None:
+      with self.__lock,metrics.timer('spav_data_seconds',operation='read_expressions'):
+        return {array: numpy.array(self.__file['arrays'][array]['data']['expressions'][gene]) for array in self.arrays}
+
+    expressions = self.__read_expression_row(gene)
+
+    return {array: expressions[start:end] for array,(start,end) in self.spot_offsets.items()}
+
+  def __rows_in_array_order(self):
+    # whether the spots of the arrays are in the rows of the matrix in the
+    # order of the arrays so that a row can be used without rearranging it
+    if self.spot_offsets is None:
+      return False
+
+    start = 0
+    for array in self.arrays:
+      if self.spot_offsets[array][0] != start:
+        return False
+      start = self.spot_offsets[array][1]
+
+    return start == self.__file['expressions'].shape[1]
+
+  def __load_expressions(self,gene):
+    summary = self.read_lambda_summary(gene)
+
+    if self.__rows_in_order:
+      return GeneExpressions(self.__read_expression_row(gene),self.spot_offsets,
+                             None if summary is None else summary['p95'])
+
+    expressions = self.read_expressions(gene)
+
+    # the offsets of the arrays in the concatenated vector
+    offsets = {}
+    start = 0
+    for array in self.arrays:
+      offsets[array] = (start,start+len(expressions[array]))
+      start += len(expressions[array])
+
+    return GeneExpressions(numpy.concatenate([expressions[array] for array in self.arrays]),offsets,
+                           None if summary is None else summary['p95'])
+
+  def get_expressions(self,gene,prefetch=False):
+    # the loads of the views go before the prefetching
+    with contextlib.nullcontext() if prefetch else self.prefetcher.foreground():
+      return self.expression_cache.get(gene,self.__load_expressions)
+
+  def read_density(self,gene):
+    # the evaluation points and the densities (points x beta x aar) of the gene
+    with self.__lock,metrics.timer('spav_data_seconds',operation='read_density'):
+      density = self.__file['beta']['density']
+      # data files prepared before the density cube store one dataset per gene
+      if isinstance(density,h5py.Group):
+        return self.evaluation_points,numpy.array(density[gene])
+
+      # (a view if the densities are memory-mapped and not quantized)
+      values = density[self.gene_index[gene]] if self.__density_map is None else self.__density_map[self.gene_index[gene]]
+      if values.dtype == numpy.uint16:
+        values = values*numpy.float32(self.__file['beta']['density_scale'][self.gene_index[gene]])
+
+      if self.evaluation_points is not None:
+        return self.evaluation_points,values
+
+      support = self.__file['beta']['support'][self.gene_index[gene]]
+
+    # data files prepared before the per-density supports have one support per gene
+    if support.ndim == 1:
+      return numpy.linspace(support[0],support[1],values.shape[0]),values
+
+    return support_points(support,values.shape[0]),values
+
+  def __load_density(self,gene):
+    return GeneDensity(*self.read_density(gene),self.read_density_max(gene))
+
+  def get_density(self,gene,prefetch=False):
+    with contextlib.nullcontext() if prefetch else self.prefetcher.foreground():
+      return self.density_cache.get(gene,self.__load_density)
+
+  def memory_usage(self):
+    # the approximate number of bytes held by the dataset in memory (the
+    # memory-mapped arrays are not counted)
+    nbytes = self.expression_cache.resident_nbytes+self.density_cache.resident_nbytes
+    for array in self.arrays.values():
+      nbytes += sum(resident_nbytes(array[key]) for key in ['coordinates','registered_coordinates','annotation_codes'])
+
+    return nbytes
+
+  def close(self):
+    self.prefetcher.close()
+    with self.__lock:
+      self.__file.close()
+      # the maps are unmapped when the views of the sessions are gone
+      self.__expressions_map = self.__density_map = None
+
+class DatasetRegistry:
+  # the datasets (directory/<name>.hdf5) hosted by a server; a dataset is
+  # opened when a session first acquires it and the sessions release it when
+  # they are destroyed; the datasets without sessions are closed after being
+  # idle for idle_timeout seconds or, least recently used first, when the
+  # datasets use more than max_bytes of memory
+  def __init__(self,directory,idle_timeout=1800,max_bytes=None,**kwargs):
+    self.directory = directory
+    self.idle_timeout = idle_timeout
+    self.max_bytes = max_bytes
+    self.kwargs = kwargs
+
+    self.__datasets = {}
+    self.__references = collections.Counter()
+    self.__last_used = {}
+    self.__lock = threading.Lock()
+
+  def names(self):
+    # the datasets are listed on every call so that new datasets can be
+    # added without restarting the server
+    return sorted(os.path.splitext(os.path.basename(filename))[0] for filename in glob.glob(os.path.join(self.directory,'*.hdf5')))
+
+  def acquire(self,name):
+    if name not in self.names():
+      raise KeyError(name)
+
+    with self.__lock:
+      if name not in self.__datasets:
+        logging.info('Opening the dataset %s'%(name))
+        self.__datasets[name] = Dataset(os.path.join(self.directory,'%s.hdf5'%(name)),**self.kwargs)
+      self.__references[name] += 1
+      self.__last_used[name] = time.time()
+      return self.__datasets[name]
+
+  def release(self,name):
+    with self.__lock:
+      if self.__references[name] > 0:
+        self.__references[name] -= 1
+      self.__last_used[name] = time.time()
+
+  def evict(self):
+    # close the idle datasets and the least recently used datasets without
+    # sessions until the datasets fit in the memory budget
+    with self.__lock:
+      now = time.time()
+      unused = sorted((name for name in self.__datasets if self.__references[name] == 0),key=lambda name: self.__last_used[name])
+
+      evicted = [name for name in unused if now-self.__last_used[name] > self.idle_timeout]
+      if self.max_bytes is not None:
+        nbytes = sum(dataset.memory_usage() for name,dataset in self.__datasets.items() if name not in evicted)
+        for name in unused:
+          if nbytes <= self.max_bytes:
+            break
+          if name not in evicted:
+            evicted.append(name)
+            nbytes -= self.__datasets[name].memory_usage()
+
+      datasets = [self.__datasets.pop(name) for name in evicted]
+
+    for name,dataset in zip(evicted,datasets):
+      logging.info('Closing the dataset %s'%(name))
+      dataset.close()
+
+    return evicted
+
+  def stats(self):
+    with self.__lock:
+      return {'open': len(self.__datasets),'sessions': sum(self.__references.values()),
+              'nbytes': sum(dataset.memory_usage() for dataset in self.__datasets.values())}
+
+_datasets = {}
+_datasets_lock = threading.Lock()
+_registries = {}
+
+def get_dataset(filename,**kwargs):
+  # one Dataset per data file per process; the keyword arguments
+  # are used only when the Dataset is created
+  if isinstance(filename,Dataset):
+    return filename
+
+  filename = os.path.abspath(filename)
+  with _datasets_lock:
+    if filename not in _datasets:
+      _datasets[filename] = Dataset(filename,**kwargs)
+    return _datasets[filename]
+
+def get_registry(directory,**kwargs):
+  # one DatasetRegistry per directory per process; the keyword arguments
+  # are used only when the DatasetRegistry is created
+  directory = os.path.abspath(directory)
+  with _datasets_lock:
+    if directory not in _registries:
+      _registries[directory] = DatasetRegistry(directory,**kwargs)
+    return _registries[directory]
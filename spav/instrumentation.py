@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+
+import tornado.web
+
+logger = logging.getLogger('spav.instrumentation')
+
+# the upper bounds of the histogram buckets in seconds
+BUCKETS = (0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0,60.0,float('inf'))
+
+class Histogram:
+  def __init__(self,buckets=BUCKETS):
+    self.buckets = buckets
+    self.counts = [0]*len(buckets)
+    self.count = 0
+    self.sum = 0.0
+    self.max = 0.0
+
+  def observe(self,value):
+    self.counts[bisect.bisect_left(self.buckets,value)] += 1
+    self.count += 1
+    self.sum += value
+    self.max = max(self.max,value)
+
+  def quantile(self,q):
+    # the upper bound of the bucket containing the quantile
+    if self.count == 0:
+      return 0.0
+    cumulative = 0
+    for bound,count in zip(self.buckets,self.counts):
+      cumulative += count
+      if cumulative >= q*self.count:
+        return min(bound,self.max)
+    return self.max
+
+class Timer:
+  def __init__(self,metrics,name,labels):
+    self.metrics = metrics
+    self.name = name
+    self.labels = labels
+    self.elapsed = 0.0
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self,*args):
+    self.elapsed = time.perf_counter()-self.start
+    self.metrics.observe(self.name,self.elapsed,**self.labels)
+
+class NullTimer:
+  elapsed = 0.0
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self,*args):
+    pass
+
+class Metrics:
+  # thread-safe histograms keyed by the metric name and its labels; nothing
+  # is recorded or logged unless the instrumentation has been enabled
+  def __init__(self,enabled=False):
+    self.enabled = enabled
+    self.__histograms = {}
+    self.__gauges = {}
+    self.__lock = threading.Lock()
+
+  def observe(self,name,seconds,**labels):
+    if not self.enabled:
+      return
+    key = (name,tuple(sorted(labels.items())))
+    with self.__lock:
+      if key not in self.__histograms:
+        self.__histograms[key] = Histogram()
+      self.__histograms[key].observe(seconds)
+
+  def timer(self,name,**labels):
+    if not self.enabled:
+      return NullTimer()
+    return Timer(self,name,labels)
+
+  def log(self,event,**fields):
+    # one JSON object per line so that the logs can be parsed
+    if self.enabled:
+      logger.info(json.dumps(dict(event=event,**fields),sort_keys=True,default=str))
+
+  def add_gauge(self,name,function):
+    # function returns a dictionary of the current values of the gauge
+    with self.__lock:
+      self.__gauges[name] = function
+
+  def reset(self):
+    with self.__lock:
+      self.__histograms = {}
+
+  def snapshot(self):
+    with self.__lock:
+      histograms = [(name,dict(labels),histogram.count,histogram.sum,histogram.max,
+                     histogram.quantile(0.5),histogram.quantile(0.95),list(zip(histogram.buckets,histogram.counts)))
+                    for (name,labels),histogram in sorted(self.__histograms.items())]
+      gauges = list(self.__gauges.items())
+
+    return {'histograms': [{'name': name,'labels': labels,'count': count,'sum': total,'max': maximum,'p50': p50,'p95': p95,
+                            'buckets': [[bound if bound != float('inf') else '+Inf',count] for bound,count in buckets]}
+                           for name,labels,count,total,maximum,p50,p95,buckets in histograms],
+            'gauges': {name: function() for name,function in gauges}}
+
+  def render(self):
+    # the Prometheus text exposition format
+    snapshot = self.snapshot()
+
+    def format_labels(labels):
+      return '{%s}'%(','.join('%s="%s"'%(key,str(value).replace('"','\\"')) for key,value in sorted(labels.items()))) if labels else ''
+
+    lines = []
+    for name in sorted(set(histogram['name'] for histogram in snapshot['histograms'])):
+      lines.append('# TYPE %s histogram'%(name))
+      for histogram in snapshot['histograms']:
+        if histogram['name'] != name:
+          continue
+        cumulative = 0
+        for bound,count in histogram['buckets']:
+          cumulative += count
+          lines.append('%s_bucket%s %d'%(name,format_labels(dict(histogram['labels'],le=bound)),cumulative))
+        lines.append('%s_sum%s %.6f'%(name,format_labels(histogram['labels']),histogram['sum']))
+        lines.append('%s_count%s %d'%(name,format_labels(histogram['labels']),histogram['count']))
+    for name,values in sorted(snapshot['gauges'].items()):
+      for key,value in sorted(values.items()):
+        lines.append('%s_%s %s'%(name,key,value))
+
+    return '\n'.join(lines)+'\n'
+
+# the instrumentation is opt-in
+metrics = Metrics(enabled=os.environ.get('SPAV_INSTRUMENTATION','0') not in ['','0'])
+
+def enable(enabled=True):
+  metrics.enabled = enabled
+
+class MetricsHandler(tornado.web.RequestHandler):
+  def get(self):
+    if self.get_argument('format','text') == 'json':
+      self.set_header('Content-Type','application/json')
+      self.write(json.dumps(metrics.snapshot()))
+    else:
+      self.set_header('Content-Type','text/plain; version=0.0.4')
+      self.write(metrics.render())
+
+def start_metrics_server(port,address=''):
+  # serve /metrics next to the Bokeh application on the current event loop
+  application = tornado.web.Application([('/metrics',MetricsHandler)])
+  return application.listen(port,address=address)
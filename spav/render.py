@@ -0,0 +1,213 @@
+import io
+import os
+import base64
+
+import numpy
+
+import bokeh.palettes
+
+from PIL import Image, ImageDraw, ImageFont
+Image.MAX_IMAGE_PIXELS = 1000000000
+
+from spav.data import Dataset
+
+TITLE_HEIGHT = 20
+COLORBAR_HEIGHT = 40
+MARGIN = 10
+
+# the ranges and the spot radius of the common coordinate view
+COMMON_COORDINATE_RANGE = (-8,8)
+COMMON_COORDINATE_RADIUS = 0.1
+
+VIEWS = ['arrays','common-coordinate']
+FORMATS = ['png','svg']
+
+def palette_to_rgb(palette):
+  return numpy.array([[int(color[i:i+2],16) for i in (1,3,5)] for color in palette],dtype=numpy.uint8)
+
+def map_colors(values,colors,low,high):
+  # the same mapping as LinearColorMapper
+  if high <= low:
+    return colors[numpy.zeros(len(values),dtype=int)]
+  return colors[numpy.clip(((values-low)/(high-low)*len(colors)).astype(int),0,len(colors)-1)]
+
+def encode_image(image,format='PNG'):
+  buffer = io.BytesIO()
+  image.save(buffer,format=format)
+  return 'data:image/%s;base64,%s'%(format.lower(),base64.b64encode(buffer.getvalue()).decode('ascii'))
+
+def escape_xml(text):
+  return text.replace('&','&amp;').replace('<','&lt;').replace('>','&gt;')
+
+class Panel:
+  # a plot of spots over a background; the spots are in the data coordinates
+  # whose y-axis points up and (x_range[0],y_range[0]) is the bottom left corner
+  def __init__(self,title,x_range,y_range,width,x,y,radius,colors,background=None,background_color=(255,255,255)):
+    self.title = title
+    self.x_range = x_range
+    self.y_range = y_range
+    self.scale = width/(x_range[1]-x_range[0])
+    self.width = int(width)
+    self.height = int(round((y_range[1]-y_range[0])*self.scale))
+    self.x = (x-x_range[0])*self.scale
+    self.y = (y_range[1]-y)*self.scale
+    self.radius = radius*self.scale
+    self.colors = colors
+    self.background = background
+    self.background_color = background_color
+
+class Renderer:
+  # renders the expression of a gene on the arrays (ExpressionOnArrays) and
+  # in the common coordinate system (ExpressionInCommonCoordinate); the
+  # backgrounds of the panels are read and resized once per renderer
+  def __init__(self,data_filename,static_directory,panel_width=300,n_columns=4,thumbnails=True,alpha=0.8):
+    self.dataset = Dataset(data_filename)
+    # the images of the datasets hosted by a server are in subdirectories of the static directory
+    self.static_directory = os.path.join(static_directory,self.dataset.static_subdirectory)
+    self.panel_width = panel_width
+    self.n_columns = n_columns
+    self.thumbnails = thumbnails
+    self.alpha = alpha
+
+    self.__backgrounds = {}
+    self.__encoded_backgrounds = {}
+
+    self.font = ImageFont.load_default()
+
+  def background(self,array):
+    if array not in self.__backgrounds:
+      data = self.dataset.arrays[array]
+      # the thumbnail is used if it has at least one pixel per panel pixel
+      if self.thumbnails and data['thumbnail'] is not None and data['thumbnail']['scale'][0]*data['resolution'][0] >= self.panel_width:
+        filename = os.path.join(self.static_directory,data['thumbnail']['filename'])
+      else:
+        filename = os.path.join(self.static_directory,data['filename'])
+      image = Image.open(filename).convert('RGB')
+      height = int(round(data['resolution'][1]*self.panel_width/data['resolution'][0]))
+      self.__backgrounds[array] = image.resize((self.panel_width,height),Image.BILINEAR)
+
+    return self.__backgrounds[array]
+
+  def encoded_background(self,array):
+    if array not in self.__encoded_backgrounds:
+      self.__encoded_backgrounds[array] = encode_image(self.background(array),'JPEG')
+    return self.__encoded_backgrounds[array]
+
+  def array_panels(self,gene):
+    expression_data = self.dataset.get_expressions(gene)
+    colors = palette_to_rgb(bokeh.palettes.Viridis256)
+
+    panels = []
+    for array,data in self.dataset.arrays.items():
+      panels.append(Panel(data['title'],(0,data['resolution'][0]),(0,data['resolution'][1]),self.panel_width,
+                          data['coordinates'][:,0],data['coordinates'][:,1],data['spot_radius'],
+                          map_colors(expression_data.array(array),colors,0,expression_data.vmax),background=array))
+
+    return panels,bokeh.palettes.Viridis256,expression_data.vmax
+
+  def common_coordinate_panels(self,gene):
+    expression_data = self.dataset.get_expressions(gene)
+    colors = palette_to_rgb(bokeh.palettes.Inferno256)
+
+    panels = []
+    for variable in self.dataset.level_1_variables:
+      arrays = self.dataset.level_1_arrays[variable]
+      coordinates = numpy.vstack([self.dataset.arrays[array]['registered_coordinates'] for array in arrays])
+      expressions = numpy.concatenate([expression_data.array(array) for array in arrays])
+      panels.append(Panel(variable,COMMON_COORDINATE_RANGE,COMMON_COORDINATE_RANGE,self.panel_width,
+                          coordinates[:,0],coordinates[:,1],COMMON_COORDINATE_RADIUS,
+                          map_colors(expressions,colors,0,expression_data.vmax),background_color=(128,128,128)))
+
+    return panels,bokeh.palettes.Inferno256,expression_data.vmax
+
+  def __layout(self,panels):
+    # the positions of the panels in a grid of n_columns columns below the title
+    row_height = max(panel.height for panel in panels)+TITLE_HEIGHT
+    positions = [(MARGIN+(idx%self.n_columns)*(self.panel_width+MARGIN),
+                  TITLE_HEIGHT+MARGIN+(idx//self.n_columns)*(row_height+MARGIN)) for idx in range(len(panels))]
+    width = MARGIN+min(len(panels),self.n_columns)*(self.panel_width+MARGIN)
+    height = TITLE_HEIGHT+MARGIN+int(numpy.ceil(len(panels)/self.n_columns))*(row_height+MARGIN)+COLORBAR_HEIGHT+MARGIN
+    return positions,width,height
+
+  def __colorbar_ticks(self,vmax):
+    return [(fraction,'%.3g'%(fraction*vmax)) for fraction in [0,0.25,0.5,0.75,1]]
+
+  def render_png(self,title,panels,palette,vmax,filename):
+    positions,width,height = self.__layout(panels)
+    image = Image.new('RGBA',(width,height),(255,255,255,255))
+    draw = ImageDraw.Draw(image)
+    draw.text((MARGIN,MARGIN//2),title,fill=(0,0,0),font=self.font)
+
+    for panel,(left,top) in zip(panels,positions):
+      draw.text((left,top),panel.title,fill=(0,0,0),font=self.font)
+      top += TITLE_HEIGHT
+      if panel.background is not None:
+        image.paste(self.background(panel.background),(left,top))
+      else:
+        draw.rectangle([left,top,left+panel.width-1,top+panel.height-1],fill=panel.background_color)
+
+      # the translucent spots are drawn on a separate layer clipped to the panel
+      layer = Image.new('RGBA',(panel.width,panel.height),(0,0,0,0))
+      layer_draw = ImageDraw.Draw(layer)
+      alpha = int(round(255*self.alpha))
+      for x,y,color in zip(panel.x,panel.y,panel.colors):
+        layer_draw.ellipse([x-panel.radius,y-panel.radius,x+panel.radius,y+panel.radius],fill=tuple(color)+(alpha,))
+      image.alpha_composite(layer,(left,top))
+
+    # the horizontal color bar below the panels
+    bar_width = min(width-2*MARGIN,256)
+    left,top = MARGIN,height-COLORBAR_HEIGHT-MARGIN
+    draw.text((left,top),'Expression',fill=(0,0,0),font=self.font)
+    bar = palette_to_rgb(palette)[numpy.linspace(0,len(palette)-1,bar_width).astype(int)]
+    image.paste(Image.fromarray(numpy.repeat(bar[None,:,:],10,axis=0)),(left,top+12))
+    for fraction,label in self.__colorbar_ticks(vmax):
+      draw.text((left+fraction*(bar_width-1),top+24),label,fill=(0,0,0),font=self.font)
+
+    image.convert('RGB').save(filename)
+
+  def render_svg(self,title,panels,palette,vmax,filename):
+    positions,width,height = self.__layout(panels)
+
+    elements = ['<rect width="%d" height="%d" fill="white"/>'%(width,height),
+                '<text x="%d" y="%d" font-family="sans-serif" font-size="12">%s</text>'%(MARGIN,MARGIN+6,escape_xml(title))]
+    for idx,(panel,(left,top)) in enumerate(zip(panels,positions)):
+      elements.append('<text x="%d" y="%d" font-family="sans-serif" font-size="11">%s</text>'%(left,top+12,escape_xml(panel.title)))
+      top += TITLE_HEIGHT
+      elements.append('<clipPath id="panel%d"><rect x="%d" y="%d" width="%d" height="%d"/></clipPath>'%(idx,left,top,panel.width,panel.height))
+      elements.append('<g clip-path="url(#panel%d)">'%(idx))
+      if panel.background is not None:
+        elements.append('<image x="%d" y="%d" width="%d" height="%d" xlink:href="%s"/>'%(left,top,panel.width,panel.height,self.encoded_background(panel.background)))
+      else:
+        elements.append('<rect x="%d" y="%d" width="%d" height="%d" fill="rgb(%d,%d,%d)"/>'%((left,top,panel.width,panel.height)+tuple(panel.background_color)))
+      elements.append('<g fill-opacity="%g">'%(self.alpha))
+      for x,y,color in zip(panel.x,panel.y,panel.colors):
+        elements.append('<circle cx="%.1f" cy="%.1f" r="%.2f" fill="#%02x%02x%02x"/>'%((left+x,top+y,panel.radius)+tuple(color)))
+      elements.append('</g></g>')
+
+    bar_width = min(width-2*MARGIN,256)
+    left,top = MARGIN,height-COLORBAR_HEIGHT-MARGIN
+    elements.append('<text x="%d" y="%d" font-family="sans-serif" font-size="11">Expression</text>'%(left,top+10))
+    bar = palette_to_rgb(palette)[numpy.linspace(0,len(palette)-1,bar_width).astype(int)]
+    elements.append('<image x="%d" y="%d" width="%d" height="10" preserveAspectRatio="none" xlink:href="%s"/>'%(left,top+12,bar_width,
+                                                                                                               encode_image(Image.fromarray(bar[None,:,:]))))
+    for fraction,label in self.__colorbar_ticks(vmax):
+      elements.append('<text x="%.1f" y="%d" font-family="sans-serif" font-size="10">%s</text>'%(left+fraction*(bar_width-1),top+34,label))
+
+    with open(filename,'w') as f:
+      f.write('<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" width="%d" height="%d" viewBox="0 0 %d %d">\n'%(width,height,width,height))
+      f.write('\n'.join(elements))
+      f.write('\n</svg>\n')
+
+  def render(self,gene,view,filename,format='png'):
+    if view == 'arrays':
+      panels,palette,vmax = self.array_panels(gene)
+    else:
+      panels,palette,vmax = self.common_coordinate_panels(gene)
+
+    if format == 'svg':
+      self.render_svg(gene,panels,palette,vmax,filename)
+    else:
+      self.render_png(gene,panels,palette,vmax,filename)
+
+  def close(self):
+    self.dataset.close()
@@ -0,0 +1,64 @@
+class GeneSearchIndex:
+  # case-insensitive search over the gene names and their aliases;
+  # prefix queries use a trie and substring queries use a trigram index
+  def __init__(self,genes,aliases=None):
+    if aliases is None:
+      aliases = {}
+
+    # every searchable name points to the genes whose names or aliases
+    # differ from it only in case
+    names = {}
+    for gene in genes:
+      names.setdefault(gene.lower(),[]).append(gene)
+    for alias,gene in aliases.items():
+      if gene not in names.setdefault(alias.lower(),[]):
+        names[alias.lower()].append(gene)
+
+    # the names are ranked by their lengths and then alphabetically
+    self.names = sorted(names,key=lambda name: (len(name),name))
+    self.name_genes = [names[name] for name in self.names]
+
+    self.trie = {}
+    self.trigrams = {}
+    for idx,name in enumerate(self.names):
+      node = self.trie
+      for character in name:
+        node = node.setdefault(character,{})
+        # the names with the prefix in the rank order
+        node.setdefault(None,[]).append(idx)
+      for trigram in set(name[i:i+3] for i in range(len(name)-2)):
+        self.trigrams.setdefault(trigram,set()).add(idx)
+
+  def __prefix_matches(self,query):
+    node = self.trie
+    for character in query:
+      if character not in node:
+        return []
+      node = node[character]
+    return node[None]
+
+  def __substring_matches(self,query):
+    if len(query) < 3:
+      return []
+
+    postings = [self.trigrams.get(query[i:i+3],set()) for i in range(len(query)-2)]
+    candidates = set.intersection(*sorted(postings,key=len))
+
+    return sorted((idx for idx in candidates if query in self.names[idx]),key=lambda idx: (self.names[idx].find(query),idx))
+
+  def search(self,query,limit=10):
+    # the prefix matches are listed before the other substring matches
+    query = query.lower()
+    if len(query) == 0:
+      return []
+
+    genes = []
+    for matches in (self.__prefix_matches(query),self.__substring_matches(query)):
+      for idx in matches:
+        for gene in self.name_genes[idx]:
+          if gene not in genes:
+            genes.append(gene)
+            if len(genes) == limit:
+              return genes
+
+    return genes
@@ -0,0 +1,69 @@
+import os
+
+import numpy
+
+TILE_EXTENSION = 'jpg'
+
+def get_tile_filename(level,column,row):
+  return os.path.join(str(level),'%d_%d.%s'%(column,row,TILE_EXTENSION))
+
+def get_number_of_levels(resolution,tile_size):
+  # the coarsest level fits in a single tile
+  return int(max(numpy.ceil(numpy.log2(max(resolution)/tile_size)),0))+1
+
+def build_tile_pyramid(image,directory,tile_size=256,quality=90):
+  # level 0 has the full resolution and every following level is
+  # downscaled by a factor of two
+  image = image.convert('RGB')
+  n_levels = get_number_of_levels(image.size,tile_size)
+
+  for level in range(n_levels):
+    if level > 0:
+      image = image.resize((max((image.size[0]+1)//2,1),max((image.size[1]+1)//2,1)))
+    os.makedirs(os.path.join(directory,str(level)),exist_ok=True)
+    for column in range(int(numpy.ceil(image.size[0]/tile_size))):
+      for row in range(int(numpy.ceil(image.size[1]/tile_size))):
+        tile = image.crop((column*tile_size,row*tile_size,
+                           min((column+1)*tile_size,image.size[0]),min((row+1)*tile_size,image.size[1])))
+        tile.save(os.path.join(directory,get_tile_filename(level,column,row)),quality=quality)
+
+  return n_levels
+
+def build_thumbnail(image,filename,max_size=512,quality=90):
+  # a downscaled copy of the image whose longer edge is at most max_size
+  thumbnail = image.convert('RGB')
+  thumbnail.thumbnail((max_size,max_size))
+  os.makedirs(os.path.dirname(filename),exist_ok=True)
+  thumbnail.save(filename,quality=quality)
+
+  return thumbnail.size
+
+def select_tiles(directory,resolution,tile_size,n_levels,x_range,y_range,plot_width):
+  # pick the level whose resolution matches the screen resolution
+  # and the tiles of that level overlapping the visible region;
+  # the tiles are positioned in the image coordinates of the plots,
+  # i.e. (0,0) is the bottom left corner of the image
+  xdim,ydim = resolution
+  x_start,x_end = max(x_range[0],0),min(x_range[1],xdim)
+  y_start,y_end = max(y_range[0],0),min(y_range[1],ydim)
+
+  tiles = {'image': [],'x': [],'y': [],'w': [],'h': []}
+  if x_start >= x_end or y_start >= y_end:
+    return tiles
+
+  pixels_per_screen_pixel = (x_range[1]-x_range[0])/max(plot_width,1)
+  level = int(numpy.clip(numpy.floor(numpy.log2(max(pixels_per_screen_pixel,1))),0,n_levels-1))
+  level_tile_size = tile_size*2**level
+
+  # the rows of the tiles start from the top of the image
+  for column in range(int(x_start//level_tile_size),int(numpy.ceil(x_end/level_tile_size))):
+    for row in range(int((ydim-y_end)//level_tile_size),int(numpy.ceil((ydim-y_start)/level_tile_size))):
+      w = min(level_tile_size,xdim-column*level_tile_size)
+      h = min(level_tile_size,ydim-row*level_tile_size)
+      tiles['image'].append(os.path.join(directory,get_tile_filename(level,column,row)))
+      tiles['x'].append(column*level_tile_size)
+      tiles['y'].append(ydim-row*level_tile_size-h)
+      tiles['w'].append(w)
+      tiles['h'].append(h)
+
+  return tiles
@@ -1,16 +1,25 @@
 import os
+import json
+import time
 
 import numpy
 import colorsys
+import functools
+import contextlib
+import concurrent.futures
 
-import h5py
 import bokeh.models
 import bokeh.plotting
 
-from bokeh.core.properties import List, String
+from bokeh.core.properties import Int, List, String
 from bokeh.util.compiler import TypeScript
 from bokeh.models import TextInput
 
+from spav.data import get_dataset
+from spav.density import interpolate_density
+from spav.instrumentation import metrics
+from spav.tiles import select_tiles
+
 class AutocompleteInputCustom(TextInput):
     __implementation__ = TypeScript("""
       import {TextInput, TextInputView} from "models/widgets/text_input"
@@ -28,8 +37,16 @@ class AutocompleteInputCustom(TextInput):
       
         protected _hover_index: number = 0
       
+        protected _timeout: number | null = null
+      
         protected menu: HTMLElement
       
+        connect_signals(): void {
+          super.connect_signals()
+          this.connect(this.model.properties.completions.change, () => this._on_completions())
+          this.connect(this.model.properties.completions_query.change, () => this._on_completions())
+        }
+      
         render(): void {
           super.render()
       
@@ -64,11 +81,26 @@ class AutocompleteInputCustom(TextInput):
             const item = div({}, text)
             this.menu.appendChild(item)
           }
+          this._hover_index = 0
           if (completions.length > 0)
             this.menu.children[0].classList.add('bk-active')
       
         }
       
+        protected _on_completions(): void {
+          // ignore the completions of a query the user is no longer typing
+          const value = this.input_el.value
+          if (value.length <= 1 || value != this.model.completions_query)
+            return
+      
+          this._update_completions(this.model.completions)
+      
+          if (this.model.completions.length == 0)
+            this._hide_menu()
+          else
+            this._show_menu()
+        }
+      
         protected _show_menu(): void {
           if (!this._open) {
             this._open = true
@@ -145,23 +177,26 @@ class AutocompleteInputCustom(TextInput):
             default: {
               const value = this.input_el.value
       
+              if (this._timeout != null) {
+                window.clearTimeout(this._timeout)
+                this._timeout = null
+              }
+      
               if (value.length <= 1) {
                 this._hide_menu()
                 return
               }
       
-              const completions: string[] = []
-              for (const text of this.model.completions) {
-                if (text.indexOf(value) != -1)
-                  completions.push(text)
+              if (value == this.model.completions_query) {
+                this._on_completions()
+                return
               }
       
-              this._update_completions(completions)
-      
-              if (completions.length == 0)
-                this._hide_menu()
-              else
-                this._show_menu()
+              // the completions are searched on the server once the user stops typing
+              this._timeout = window.setTimeout(() => {
+                this._timeout = null
+                this.model.query = value
+              }, this.model.debounce)
             }
           }
         }
@@ -172,6 +207,9 @@ class AutocompleteInputCustom(TextInput):
       
         export type Props = TextInput.Props & {
           completions: p.Property<string[]>
+          completions_query: p.Property<string>
+          query: p.Property<string>
+          debounce: p.Property<number>
         }
       }
       
@@ -189,7 +227,10 @@ class AutocompleteInputCustom(TextInput):
           this.prototype.default_view = AutocompleteInputViewCustom
       
           this.define<AutocompleteInputCustom.Props>({
-            completions: [ p.Array, [] ],
+            completions:       [ p.Array,  []  ],
+            completions_query: [ p.String, ""  ],
+            query:             [ p.String, ""  ],
+            debounce:          [ p.Number, 200 ],
           })
         }
       }
@@ -197,13 +238,194 @@ class AutocompleteInputCustom(TextInput):
 
     """)
     completions = List(String,help="")
+    completions_query = String(default="",help="")
+    query = String(default="",help="")
+    debounce = Int(default=200,help="")
+
+def create_gene_input(dataset,gene,kind='expressions',limit=10):
+  # the completions are searched on the server so that only the top
+  # matches of the current query are sent to the browser
+  textinput_gene = AutocompleteInputCustom(value=gene,title='Gene:',width=300)
+
+  def update_completions(attr,old,new):
+    textinput_gene.completions = dataset.search_index.search(new,limit) if len(new) > 1 else []
+    textinput_gene.completions_query = new
+    # the user is likely to select one of the completions
+    dataset.prefetcher.prefetch(textinput_gene.completions,kind)
+
+  def record_selection(attr,old,new):
+    dataset.prefetcher.record(old,new,kind)
+
+  textinput_gene.on_change('query',update_completions)
+  textinput_gene.on_change('value',record_selection)
+
+  return textinput_gene
+
+# the pool loading the selected genes outside the event loop of the server
+_gene_load_executor = concurrent.futures.ThreadPoolExecutor(max_workers=int(os.environ.get('SPAV_GENE_LOAD_THREADS',4)))
+
+class GeneLoader:
+  # load(gene) runs in the pool and apply(gene,data) on the next tick of
+  # the document; every request supersedes the earlier ones so that only
+  # the most recent selection is applied (and loaded if it has not started)
+  def __init__(self,load,apply,fail,view=None):
+    self.load = load
+    self.apply = apply
+    self.fail = fail
+    self.view = view
+    self.generation = 0
+    self.__future = None
+
+  def request(self,gene,document):
+    self.generation += 1
+    requested = time.perf_counter()
+
+    if self.__future is not None:
+      self.__future.cancel()
+      self.__future = None
+
+    # without a server session there is no event loop to return to
+    if document is None or document.session_context is None:
+      try:
+        data = self.__load(self.generation,gene)
+      except Exception as exception:
+        self.fail(gene,exception)
+      else:
+        self.__finish(gene,data,requested)
+      return
+
+    generation = self.generation
+    self.__future = _gene_load_executor.submit(self.__load,generation,gene)
+    self.__future.add_done_callback(lambda future: future.cancelled() or
+                                    document.add_next_tick_callback(functools.partial(self.__apply,generation,gene,requested,future)))
+
+  def __load(self,generation,gene):
+    if generation != self.generation:
+      return None
+    with metrics.timer('spav_view_seconds',view=self.view,operation='load') as timer:
+      data = self.load(gene)
+    return data,timer.elapsed
+
+  def __apply(self,generation,gene,requested,future):
+    if generation != self.generation:
+      return
+    self.__future = None
+    if future.exception() is not None:
+      self.fail(gene,future.exception())
+    else:
+      self.__finish(gene,future.result(),requested)
+
+  def __finish(self,gene,result,requested):
+    data,load_time = result
+    with metrics.timer('spav_view_seconds',view=self.view,operation='apply') as timer:
+      self.apply(gene,data)
+
+    # the time from the request to the applied changes including the wait in the pool
+    total_time = time.perf_counter()-requested
+    metrics.observe('spav_view_seconds',total_time,view=self.view,operation='gene_switch')
+    metrics.log('gene_switch',view=self.view,gene=gene,load=load_time,apply=timer.elapsed,total=total_time)
+
+@contextlib.contextmanager
+def hold_document(document,view=None):
+  # combine the changes made in the block into as few messages as possible
+  if document is None:
+    yield
+    return
+
+  document.hold('combine')
+  try:
+    yield
+  finally:
+    # the combined changes are serialized when the document is released
+    with metrics.timer('spav_view_seconds',view=view,operation='send'):
+      document.unhold()
+
+def create_spot_hover(annotation_names,renderers):
+  # the annotations are sent as codes and resolved in the browser
+  annotation_formatter = bokeh.models.CustomJSHover(code='return %s[value]'%(json.dumps(annotation_names)))
+  return bokeh.models.HoverTool(tooltips=[('Expression','@expression'),('Annotation','@annotation{custom}')],
+                                formatters={'annotation': annotation_formatter},renderers=renderers)
+
+def density_column(variable_idx,aar_idx):
+  return 'density_%d_%d'%(variable_idx,aar_idx)
+
+def density_points_column(variable_idx,aar_idx):
+  return 'points_%d_%d'%(variable_idx,aar_idx)
+
+def create_density_columns(density_data,n_variables,n_aars,x_range,n_points):
+  # the densities are resampled to n_points points over the visible part of
+  # their supports, so zooming in gives more points per unit of β
+  points,values = density_data.points,density_data.values
+
+  max_value = (numpy.max(values) if density_data.density_max is None else numpy.max(density_data.density_max))*1.2
+
+  columns = {}
+  for variable_idx in range(n_variables):
+    for aar_idx in range(n_aars):
+      column_points = points if points.ndim == 1 else points[:,variable_idx,aar_idx]
+      start,end = max(x_range[0],column_points[0]),min(x_range[1],column_points[-1])
+      if start < end:
+        x = numpy.linspace(start,end,n_points)
+        y = interpolate_density(column_points,values[:,variable_idx,aar_idx],x)
+      else:
+        # the density is outside the visible range
+        x = numpy.linspace(x_range[0],x_range[1],n_points)
+        y = numpy.zeros(n_points)
+      columns[density_points_column(variable_idx,aar_idx)] = x.astype(numpy.float32)
+      columns[density_column(variable_idx,aar_idx)] = y.astype(numpy.float32)
+
+  return columns,max_value
+
+def create_image_data(static_directory,data,x_range,y_range,plot_width,thumbnails=False):
+  # use the thumbnail as long as it has at least one pixel per screen pixel
+  if thumbnails and data['thumbnail'] is not None:
+    if data['thumbnail']['scale'][0]*(x_range[1]-x_range[0])/max(plot_width,1) >= 1:
+      return {'image': [os.path.join(static_directory,data['thumbnail']['filename'])],
+              'x': [0],'y': [0],'w': [data['resolution'][0]],'h': [data['resolution'][1]]}
+
+  if data['tiles'] is None:
+    return {'image': [os.path.join(static_directory,data['filename'])],
+            'x': [0],'y': [0],'w': [data['resolution'][0]],'h': [data['resolution'][1]]}
+
+  return select_tiles(os.path.join(static_directory,data['tiles']['directory']),data['resolution'],
+                      data['tiles']['tile_size'],data['tiles']['n_levels'],x_range,y_range,plot_width)
+
+def aggregate_spots(x,y,values,x_range,y_range,shape,reduction='mean'):
+  # reduce the values of the spots in each pixel of a grid of shape
+  # (rows,columns) covering the ranges; the empty pixels are nan
+  rows,columns = shape
+  column = numpy.floor((x-x_range[0])*(columns/(x_range[1]-x_range[0]))).astype(int)
+  row = numpy.floor((y-y_range[0])*(rows/(y_range[1]-y_range[0]))).astype(int)
+  inside = (column >= 0)&(column < columns)&(row >= 0)&(row < rows)
+  pixels = row[inside]*columns+column[inside]
+  values = values[inside]
+
+  if reduction == 'max':
+    image = numpy.full(rows*columns,numpy.nan,dtype=numpy.float32)
+    if len(pixels) > 0:
+      # the spots are grouped by pixel and each group is reduced
+      order = numpy.argsort(pixels)
+      pixels = pixels[order]
+      starts = numpy.flatnonzero(numpy.append(True,pixels[1:] != pixels[:-1]))
+      image[pixels[starts]] = numpy.maximum.reduceat(values[order],starts)
+  else:
+    counts = numpy.bincount(pixels,minlength=rows*columns)
+    sums = numpy.bincount(pixels,weights=values,minlength=rows*columns)
+    with numpy.errstate(invalid='ignore',divide='ignore'):
+      image = (sums/counts).astype(numpy.float32)
+
+  return image.reshape(rows,columns)
 
 class ExpressionOnArrays:
-  def __init__(self,data_filename,static_directory,gene=None,n_columns=4):
-    self.filename = data_filename
+  def __init__(self,data_filename,static_directory,gene=None,n_columns=4,plot_width=300,thumbnails=True):
+    self.dataset = get_dataset(data_filename)
+    self.filename = self.dataset.filename
     self.static_directory = static_directory
-    self.genes = self.__read_genes()
-    self.data = self.__read_array_data()
+    self.plot_width = plot_width
+    self.thumbnails = thumbnails
+    self.genes = self.dataset.genes
+    self.gene_index = self.dataset.gene_index
+    self.data = self.dataset.arrays
 
     self.n_columns = n_columns
 
@@ -212,85 +434,79 @@ class ExpressionOnArrays:
     else:
       self.gene = gene
 
-    self.source_spots,self.vmin,self.vmax = self.__create_source_spots(self.gene)
+    self.source_spots,self.vmin,self.vmax = self.__create_source_spots(self.dataset.get_expressions(self.gene))
 
     self.source_image = self.__create_source_image()
 
     self.color_mapper = bokeh.models.mappers.LinearColorMapper('Viridis256',low=self.vmin,high=self.vmax)
     self.ticker = bokeh.models.BasicTicker(base=2,mantissas=[1,5])
 
-    self.textinput_gene = AutocompleteInputCustom(value=self.gene,title='Gene:',completions=self.genes,width=300)
+    self.textinput_gene = create_gene_input(self.dataset,self.gene)
     self.textinput_gene.on_change('value',self.__update_plot)
 
     self.error_pretext = bokeh.models.widgets.Div(text='',width=125,height=20)
 
+    self.gene_loader = GeneLoader(self.dataset.get_expressions,self.__apply_gene,self.__fail_gene,type(self).__name__)
+
     self.__plots = self.__plot()
 
     self.layout = bokeh.layouts.layout([bokeh.layouts.layout(self.__plots[0:2]),bokeh.layouts.gridplot(self.__plots[2:-1],merge_tools=True,toolbar_location='left',toolbar_options=dict(logo=None),sizing_mode='scale_both'),bokeh.layouts.layout(self.__plots[-1])],sizing_mode='scale_both')
 
-  def __read_genes(self):
-    with h5py.File(self.filename,'r') as f:
-        genes = list(map(lambda x: x.decode('UTF-8'),list(f['genes'])))
-
-    return genes
-
-  def __read_array_data(self):
-    data = {}
-    with h5py.File(self.filename,'r') as f:
-      for array in f['arrays']:
-        data[array] = {'coordinates': numpy.array(f['arrays'][array]['data']['coordinates']),
-                       'annotations': list(map(lambda x: x.decode('UTF-8'),numpy.array(f['arrays'][array]['data']['annotations']))),
-                       'spot_radius': float(numpy.array(f['arrays'][array]['image']['spot_radius'])),
-                       'resolution': numpy.array(f['arrays'][array]['image']['resolution']),
-                       'title': f['arrays'][array]['image']['title'][()]}
-
-    return data
-
-  def __create_source_spots(self,gene):
-    expression_data = {}
-    with h5py.File(self.filename,'r') as f:
-      for array in f['arrays']:
-        expression_data[array] = {'expressions': numpy.array(f['arrays'][array]['data']['expressions'][gene])}
-
+  def __create_source_spots(self,expression_data):
     vmin = 0
-    vmax = numpy.percentile(numpy.hstack([expression_data[key]['expressions'] for key in expression_data]),95)
-  
+    vmax = expression_data.vmax
+
+    # one source per array so that all the columns are sent as binary
+    # arrays; a gene change replaces only the expression columns
     source_spots = []
     for key in self.data:
       source_spots.append(bokeh.models.ColumnDataSource({'x': self.data[key]['coordinates'][:,0],
                                                          'y': self.data[key]['coordinates'][:,1],
-                                                         'expression': expression_data[key]['expressions'],
-                                                         'annotation': self.data[key]['annotations'],
-                                                         'spot_radius': self.data[key]['coordinates'].shape[0]*[self.data[key]['spot_radius']]}))
+                                                         'expression': expression_data.array(key),
+                                                         'annotation': self.data[key]['annotation_codes']}))
 
     return source_spots, vmin, vmax
 
   def __create_source_image(self):
     source_image = []
-    with h5py.File(self.filename,'r') as f:
-      for array in f['arrays']:
-        source_image.append(bokeh.models.ColumnDataSource({'image': [os.path.join(self.static_directory,f['arrays'][array]['image']['filename'][()])]}))
+    for array in self.data:
+      source_image.append(bokeh.models.ColumnDataSource(create_image_data(self.static_directory,self.data[array],
+                                                                          (0,self.data[array]['resolution'][0]),
+                                                                          (0,self.data[array]['resolution'][1]),
+                                                                          self.plot_width,self.thumbnails)))
     return source_image
 
+  def __update_tiles(self,n,array,s,attr,old,new):
+    image_data = create_image_data(self.static_directory,self.data[array],
+                                   (s.x_range.start,s.x_range.end),(s.y_range.start,s.y_range.end),
+                                   self.plot_width,self.thumbnails)
+    # request new tiles only when the visible tiles change
+    if image_data['image'] != self.source_image[n].data['image']:
+      self.source_image[n].data = image_data
+
   def __update_plot(self,attr,old,new):
-    if new not in self.genes:
+    if new not in self.gene_index:
       self.error_pretext.text = '<b>Gene not found!</b>'
       return
-    self.gene = new
-    self.error_pretext.text = ''
     self.error_pretext.text = '<b>Please wait.</b>'
-    self.textinput_gene.disabled = True
 
-    source_spots,vmin,vmax = self.__create_source_spots(self.gene)
+    self.gene_loader.request(new,self.layout.document)
+
+  def __apply_gene(self,gene,expression_data):
+    self.gene = gene
+    self.vmin,self.vmax = 0,expression_data.vmax
+
+    with hold_document(self.layout.document,type(self).__name__):
+      for n,key in enumerate(self.data):
+        self.source_spots[n].data['expression'] = expression_data.array(key)
 
-    for n in range(0,len(source_spots)):
-      self.source_spots[n].data = source_spots[n].data
+      self.color_mapper.low = self.vmin
+      self.color_mapper.high = self.vmax
 
-    self.color_mapper.low = vmin
-    self.color_mapper.high = vmax
+      self.error_pretext.text = ''
 
-    self.error_pretext.text = ''
-    self.textinput_gene.disabled = False
+  def __fail_gene(self,gene,exception):
+    self.error_pretext.text = '<b>Loading failed!</b>'
 
   def __plot(self):
     plots = []
@@ -305,7 +521,8 @@ class ExpressionOnArrays:
         plots.append(subplots)
         subplots = []
       
-      s = bokeh.plotting.figure(x_range=(0,self.data[key]['resolution'][0]),
+      s = bokeh.plotting.figure(plot_width=self.plot_width,plot_height=self.plot_width,
+                                x_range=(0,self.data[key]['resolution'][0]),
                                 y_range=(0,self.data[key]['resolution'][1]),
                                 match_aspect=True,aspect_scale=1,
                                 tools=[bokeh.models.tools.PanTool(),bokeh.models.tools.WheelZoomTool(),bokeh.models.tools.ResetTool()])
@@ -314,15 +531,18 @@ class ExpressionOnArrays:
       s.toolbar_location = None
       s.axis.visible = False
 
-      s.image_url(url='image',x=0,y=0,anchor='bottom_left',
-                  w=self.data[key]['resolution'][0],h=self.data[key]['resolution'][1],
-                  source=self.source_image[n])
+      s.image_url(url='image',x='x',y='y',anchor='bottom_left',w='w',h='h',source=self.source_image[n])
+
+      if self.data[key]['tiles'] is not None or (self.thumbnails and self.data[key]['thumbnail'] is not None):
+        for attr in ['start','end']:
+          s.x_range.on_change(attr,functools.partial(self.__update_tiles,n,key,s))
+          s.y_range.on_change(attr,functools.partial(self.__update_tiles,n,key,s))
     
-      spots = s.scatter(x='x',y='y',radius='spot_radius',
+      spots = s.scatter(x='x',y='y',radius=self.data[key]['spot_radius'],
                         fill_color={'field': 'expression','transform': self.color_mapper},
                         fill_alpha=0.8,line_color=None,source=self.source_spots[n])
 
-      hover = bokeh.models.HoverTool(tooltips=[('Expression','@expression'),('Annotation','@annotation')],renderers=[spots])
+      hover = create_spot_hover(self.dataset.annotation_names,[spots])
 
       s.add_tools(hover)
 
@@ -345,22 +565,29 @@ class ExpressionOnArrays:
     return plots
 
 class ExpressionOnArray:
-  def __init__(self,data_filename,static_directory,gene=None):
-    self.filename = data_filename
+  def __init__(self,data_filename,static_directory,gene=None,plot_width=600):
+    self.dataset = get_dataset(data_filename)
+    self.filename = self.dataset.filename
     self.static_directory = static_directory
-    self.genes = self.__read_genes()
-    self.variables,self.arrays = self.__read_data()
-    self.data = self.__read_array_data()
+    self.plot_width = plot_width
+    self.genes = self.dataset.genes
+    self.gene_index = self.dataset.gene_index
+    self.variables,self.arrays = self.dataset.level_1_variables,self.dataset.level_1_arrays
+    self.data = self.dataset.arrays
 
     if gene is None:
       self.gene = self.genes[0]
     else:
       self.gene = gene
 
+    # the most recently selected gene is loaded when the array changes
+    self.requested_gene = self.gene
+
     self.variable = self.variables[0]
     self.array = self.arrays[self.variable][0]
+    self.shown_array = self.array
 
-    self.source_array,self.vmin,self.vmax = self.__create_source_spots(self.gene,self.array)
+    self.source_array,self.vmin,self.vmax = self.__create_source_spots(self.dataset.get_expressions(self.gene),self.array)
     self.source_image = self.__create_source_image(self.array)
 
     self.color_mapper = bokeh.models.mappers.LinearColorMapper('Viridis256',low=self.vmin,high=self.vmax)
@@ -368,9 +595,11 @@ class ExpressionOnArray:
 
     self.error_pretext = bokeh.models.widgets.Div(text='',width=125,height=20)
 
-    self.textinput_gene = AutocompleteInputCustom(value=self.gene,title='Gene:',completions=self.genes,width=300)
+    self.textinput_gene = create_gene_input(self.dataset,self.gene)
     self.textinput_gene.on_change('value',self.__update_plot_gene)
 
+    self.gene_loader = GeneLoader(self.dataset.get_expressions,self.__apply_gene,self.__fail_gene,type(self).__name__)
+
     self.select_variable = bokeh.models.widgets.Select(value=self.variable,options=self.variables,title='Level 1:',width=100)
     self.select_variable.on_change('value',self.__update_plot_variable)
 
@@ -381,80 +610,62 @@ class ExpressionOnArray:
 
     self.layout = bokeh.layouts.layout([bokeh.layouts.layout(self.__plots[0:3]),bokeh.layouts.layout(self.__plots[3:-1],sizing_mode='scale_height'),bokeh.layouts.layout(self.__plots[-1])],sizing_mode='scale_width')
 
-  def __read_genes(self):
-    with h5py.File(self.filename,'r') as f:
-        genes = list(map(lambda x: x.decode('UTF-8'),list(f['genes'])))
-
-    return genes
-
-  def __read_array_data(self):
-    data = {}
-    with h5py.File(self.filename,'r') as f:
-      for array in f['arrays']:
-        data[array] = {'coordinates': numpy.array(f['arrays'][array]['data']['coordinates']),
-                       'annotations': list(map(lambda x: x.decode('UTF-8'),numpy.array(f['arrays'][array]['data']['annotations']))),
-                       'spot_radius': float(numpy.array(f['arrays'][array]['image']['spot_radius'])),
-                       'resolution': numpy.array(f['arrays'][array]['image']['resolution']),
-                       'title': f['arrays'][array]['image']['title'][()]}
-
-    return data
-
-  def __read_data(self,key='level_1'):
-    arrays = {}
-
-    with h5py.File(self.filename,'r') as f:
-      variables = list(f[key].keys())
-
-      for variable in variables:
-        arrays[variable] = list(map(lambda x: x.decode('UTF-8'),list(f['%s/%s'%(key,variable)]['files'])))
-
-    return variables,arrays
-
-  def __create_source_image(self,array):
-    with h5py.File(self.filename,'r') as f:
-      source_image = bokeh.models.ColumnDataSource({'image': [os.path.join(self.static_directory,f['arrays'][array]['image']['filename'][()])],
-                                                    'xdim': [list(f['arrays'][array]['image']['resolution'])[0]],
-                                                    'ydim': [list(f['arrays'][array]['image']['resolution'])[1]]})
+  def __create_source_image(self,array,x_range=None,y_range=None):
+    if x_range is None:
+      x_range = (0,self.data[array]['resolution'][0])
+    if y_range is None:
+      y_range = (0,self.data[array]['resolution'][1])
+    source_image = bokeh.models.ColumnDataSource(create_image_data(self.static_directory,self.data[array],
+                                                                   x_range,y_range,self.plot_width))
     return source_image
 
-  def __create_source_spots(self,gene,array):
-    expression_data = {}
-    with h5py.File(self.filename,'r') as f:
-      for key in f['arrays']:
-        expression_data[key] = {'expressions': numpy.array(f['arrays'][key]['data']['expressions'][gene])}
+  def __update_tiles(self,attr,old,new):
+    if self.data[self.array]['tiles'] is None:
+      return
+    source_image = self.__create_source_image(self.array,(self.s.x_range.start,self.s.x_range.end),
+                                              (self.s.y_range.start,self.s.y_range.end))
+    # request new tiles only when the visible tiles change
+    if source_image.data['image'] != self.source_image.data['image']:
+      self.source_image.data = source_image.data
 
+  def __create_source_spots(self,expression_data,array):
     vmin = 0
-    vmax = numpy.percentile(numpy.hstack([expression_data[key]['expressions'] for key in expression_data]),95)
-
-    expression_data = expression_data[array]
+    vmax = expression_data.vmax
   
     source_spots = bokeh.models.ColumnDataSource({'x': self.data[array]['coordinates'][:,0],
                                                   'y': self.data[array]['coordinates'][:,1],
-                                                  'expression': expression_data['expressions'],
-                                                  'annotation': self.data[array]['annotations'],
-                                                  'spot_radius': self.data[array]['coordinates'].shape[0]*[self.data[array]['spot_radius']]})
+                                                  'expression': expression_data.array(array),
+                                                  'annotation': self.data[array]['annotation_codes']})
 
     return source_spots, vmin, vmax
 
   def __update_plot_gene(self,attr,old,new):
-    if new not in self.genes:
+    if new not in self.gene_index:
       self.error_pretext.text = '<b>Gene not found!</b>'
       return
-    self.gene = new
-    self.error_pretext.text = ''
-
-    self.textinput_gene.disabled = True
     self.error_pretext.text = '<b>Please wait.</b>'
 
-    source_array,self.vmin,self.vmax = self.__create_source_spots(self.gene,self.array)
+    self.requested_gene = new
+    self.gene_loader.request(new,self.layout.document)
 
-    self.source_array.data = source_array.data
+  def __apply_gene(self,gene,expression_data):
+    self.gene = gene
+    self.vmin,self.vmax = 0,expression_data.vmax
+
+    with hold_document(self.layout.document,type(self).__name__):
+      if self.shown_array != self.array:
+        self.__show_array(expression_data)
+      else:
+        self.source_array.data['expression'] = expression_data.array(self.array)
 
-    self.color_mapper.low = self.vmin
-    self.color_mapper.high = self.vmax
+      self.color_mapper.low = self.vmin
+      self.color_mapper.high = self.vmax
 
-    self.textinput_gene.disabled = False
-    self.error_pretext.text = ''
+      self.error_pretext.text = ''
+
+  def __fail_gene(self,gene,exception):
+    self.requested_gene = self.gene
+    self.error_pretext.text = '<b>Loading failed!</b>'
 
   def __update_plot_variable(self,attr,old,new):
     self.variable = new
@@ -466,17 +677,26 @@ class ExpressionOnArray:
 
   def __update_plot_array(self,attr,old,new):
     self.array = new
+    self.error_pretext.text = '<b>Please wait.</b>'
+
+    # the expressions of the array are loaded in the pool as on a gene
+    # change; the array is shown when they have been loaded
+    self.gene_loader.request(self.requested_gene,self.layout.document)
+
+  def __show_array(self,expression_data):
+    self.shown_array = self.array
 
     source_image = self.__create_source_image(self.array)
-    source_array,_,_ = self.__create_source_spots(self.gene,self.array)
+    source_array,_,_ = self.__create_source_spots(expression_data,self.array)
 
     self.source_array.data = source_array.data
     self.source_image.data = source_image.data
+    self.spots.glyph.radius = self.data[self.array]['spot_radius']
 
     self.s.x_range.start = 0
-    self.s.x_range.end = source_image.data['xdim'][0]
+    self.s.x_range.end = self.data[self.array]['resolution'][0]
     self.s.y_range.start = 0
-    self.s.y_range.end = source_image.data['ydim'][0]
+    self.s.y_range.end = self.data[self.array]['resolution'][1]
 
   def __plot(self):
     plots = []
@@ -485,7 +705,8 @@ class ExpressionOnArray:
     plots.append([self.error_pretext])
     plots.append([self.select_variable,self.select_array])
   
-    self.s = bokeh.plotting.figure(x_range=(0,self.data[self.array]['resolution'][0]),
+    self.s = bokeh.plotting.figure(plot_width=self.plot_width,
+                                   x_range=(0,self.data[self.array]['resolution'][0]),
                                    y_range=(0,self.data[self.array]['resolution'][1]),
                                    match_aspect=True,aspect_scale=1,
                                    tools=[bokeh.models.tools.PanTool(),bokeh.models.tools.WheelZoomTool(),bokeh.models.tools.ResetTool(),bokeh.models.tools.SaveTool()])
@@ -494,13 +715,17 @@ class ExpressionOnArray:
     self.s.toolbar_location = 'left'
     self.s.axis.visible = False
     
-    self.s.image_url(url='image',x=0,y=0,anchor='bottom_left',w='xdim',h='ydim',source=self.source_image)
+    self.s.image_url(url='image',x='x',y='y',anchor='bottom_left',w='w',h='h',source=self.source_image)
+
+    for attr in ['start','end']:
+      self.s.x_range.on_change(attr,self.__update_tiles)
+      self.s.y_range.on_change(attr,self.__update_tiles)
     
-    spots = self.s.scatter(x='x',y='y',radius='spot_radius',
-                           fill_color={'field': 'expression','transform': self.color_mapper},
-                           fill_alpha=0.8,line_color=None,source=self.source_array)
+    self.spots = self.s.scatter(x='x',y='y',radius=self.data[self.array]['spot_radius'],
+                                fill_color={'field': 'expression','transform': self.color_mapper},
+                                fill_alpha=0.8,line_color=None,source=self.source_array)
 
-    hover = bokeh.models.HoverTool(tooltips=[('Expression','@expression'),('Annotation','@annotation')],renderers=[spots])
+    hover = create_spot_hover(self.dataset.annotation_names,[self.spots])
 
     self.s.add_tools(hover)
 
@@ -522,32 +747,31 @@ class ExpressionOnArray:
     return plots
 
 class ExpressionInCommonCoordinate:
-  def __init__(self,data_filename,gene=None,n_columns=4):
-    self.filename = data_filename
-    self.genes = self.__read_genes()
-    self.variables,self.arrays = self.__read_data()
-    self.data = self.__read_array_data()
+  AGGREGATIONS = ['mean','max']
+
+  def __init__(self,data_filename,gene=None,n_columns=4,max_spots=20000,pixel_size=4,aggregation='mean'):
+    self.dataset = get_dataset(data_filename)
+    self.filename = self.dataset.filename
+    self.genes = self.dataset.genes
+    self.gene_index = self.dataset.gene_index
+    self.variables,self.arrays = self.dataset.level_1_variables,self.dataset.level_1_arrays
+    # the spots are shown in the common coordinate system
+    self.data = {array: {'coordinates': self.dataset.arrays[array]['registered_coordinates'],
+                         'annotation_codes': self.dataset.arrays[array]['annotation_codes']} for array in self.dataset.arrays}
 
     self.n_columns = n_columns
+    # the spots of a panel are aggregated into an image of pixel_size screen
+    # pixels per pixel when more than max_spots spots are in view (None
+    # always shows the spots)
+    self.max_spots = max_spots
+    self.pixel_size = pixel_size
+    self.aggregation = aggregation
 
     if gene is None:
       self.gene = self.genes[0]
     else:
       self.gene = gene
 
-    self.source_spots,self.vmin,self.vmax = self.__create_source_spots(self.gene)
-
-    self.color_mapper = bokeh.models.mappers.LinearColorMapper('Inferno256',low=self.vmin,high=self.vmax)
-    self.ticker = bokeh.models.BasicTicker(base=2,mantissas=[1,5])
-
-    self.error_pretext = bokeh.models.widgets.Div(text='',width=125,height=20)
-
-    self.textinput_gene = AutocompleteInputCustom(value=self.gene,title='Gene:',completions=self.genes,width=300)
-    self.textinput_gene.on_change('value',self.__update_plot_gene)
-
-    self.slider = bokeh.models.Slider(start=0.01,end=1,value=0.1,step=0.005,title='Spot radius')
-    self.slider.on_change('value',self.__update_spot_size)
-
     self.s = []
     for variable in self.variables:
       s = bokeh.plotting.figure(x_range=(-8,8),
@@ -564,83 +788,180 @@ class ExpressionInCommonCoordinate:
 
       self.s.append(s)
 
-    self.__plots = self.__plot()
-
-    self.layout = bokeh.layouts.layout([bokeh.layouts.layout(self.__plots[0:3]),bokeh.layouts.gridplot(self.__plots[3:-1],merge_tools=True,toolbar_location='left',toolbar_options=dict(logo=None),sizing_mode='scale_both'),bokeh.layouts.layout(self.__plots[-1])],sizing_mode='scale_both')
-
-  def __read_genes(self):
-    with h5py.File(self.filename,'r') as f:
-        genes = list(map(lambda x: x.decode('UTF-8'),list(f['genes'])))
+    self.expression_data = self.dataset.get_expressions(self.gene)
+    self.source_spots,self.vmin,self.vmax = self.__create_source_spots(self.expression_data)
+    self.source_raster = [bokeh.models.ColumnDataSource(self.__raster_data(n)) for n in range(len(self.variables))]
 
-    return genes
+    self.color_mapper = bokeh.models.mappers.LinearColorMapper('Inferno256',low=self.vmin,high=self.vmax)
+    self.ticker = bokeh.models.BasicTicker(base=2,mantissas=[1,5])
 
-  def __read_array_data(self):
-    data = {}
-    with h5py.File(self.filename,'r') as f:
-      for array in f['arrays']:
-        data[array] = {'coordinates': numpy.array(f['arrays'][array]['data']['registered_coordinates']),
-                       'annotations': list(map(lambda x: x.decode('UTF-8'),numpy.array(f['arrays'][array]['data']['annotations'])))}
+    self.error_pretext = bokeh.models.widgets.Div(text='',width=125,height=20)
 
-    return data
+    self.textinput_gene = create_gene_input(self.dataset,self.gene)
+    self.textinput_gene.on_change('value',self.__update_plot_gene)
 
-  def __read_data(self,key='level_1'):
-    arrays = {}
+    self.gene_loader = GeneLoader(self.dataset.get_expressions,self.__apply_gene,self.__fail_gene,type(self).__name__)
 
-    with h5py.File(self.filename,'r') as f:
-      variables = list(f[key].keys())
+    self.slider = bokeh.models.Slider(start=0.01,end=1,value=0.1,step=0.005,title='Spot radius')
+    self.slider.on_change('value',self.__update_spot_size)
 
-      for variable in variables:
-        arrays[variable] = list(map(lambda x: x.decode('UTF-8'),list(f['%s/%s'%(key,variable)]['files'])))
+    self.radiobuttongroup_aggregation = bokeh.models.widgets.RadioButtonGroup(labels=['Mean','Maximum'],
+                                                                              active=self.AGGREGATIONS.index(self.aggregation))
+    self.radiobuttongroup_aggregation.on_change('active',self.__update_aggregation)
 
-    return variables,arrays
+    self.__plots = self.__plot()
 
-  def __create_source_spots(self,gene):
-    expression_data = {}
-    with h5py.File(self.filename,'r') as f:
-      for key in f['arrays']:
-        expression_data[key] = numpy.array(f['arrays'][key]['data']['expressions'][gene])
+    # the panels are updated once per tick as the ranges change several
+    # times while panning and zooming
+    self.__pending = set()
+    if self.max_spots is not None:
+      for n,s in enumerate(self.s):
+        for attr in ['start','end']:
+          s.x_range.on_change(attr,functools.partial(self.__update_viewport,n))
+          s.y_range.on_change(attr,functools.partial(self.__update_viewport,n))
+        for attr in ['inner_width','inner_height']:
+          s.on_change(attr,functools.partial(self.__update_viewport,n))
 
-    source_spots = []
+    self.layout = bokeh.layouts.layout([bokeh.layouts.layout(self.__plots[0:3]),bokeh.layouts.gridplot(self.__plots[3:-1],merge_tools=True,toolbar_location='left',toolbar_options=dict(logo=None),sizing_mode='scale_both'),bokeh.layouts.layout(self.__plots[-1])],sizing_mode='scale_both')
 
+  def __create_source_spots(self,expression_data):
+    # one source per level 1 variable; the positions of the spots in the
+    # concatenated expressions are kept so that a gene change replaces only
+    # the expression columns
+    tmp_coordinates = []
+    tmp_annotations = []
+    tmp_indices = []
+    self.variable_spots = []
+    start = 0
     for variable in self.variables:
-      tmp_coordinates = []
-      tmp_expressions = []
-      tmp_annotations = []
       for array in self.arrays[variable]:
         tmp_coordinates.append(self.data[array]['coordinates'])
-        tmp_expressions.append(expression_data[array])
-        tmp_annotations.append(self.data[array]['annotations'])
+        tmp_annotations.append(self.data[array]['annotation_codes'])
+        tmp_indices.append(numpy.arange(*expression_data.offsets[array]))
+      end = start+sum(len(self.data[array]['annotation_codes']) for array in self.arrays[variable])
+      self.variable_spots.append(numpy.arange(start,end))
+      start = end
+
+    self.coordinates = numpy.vstack(tmp_coordinates)
+    self.annotations = numpy.concatenate(tmp_annotations)
+    self.spot_indices = numpy.concatenate(tmp_indices)
 
-      source_spots.append(bokeh.models.ColumnDataSource({'x': numpy.vstack(tmp_coordinates)[:,0],
-                                                         'y': numpy.vstack(tmp_coordinates)[:,1],
-                                                         'expression': numpy.concatenate(tmp_expressions),
-                                                         'annotation': numpy.concatenate(tmp_annotations)}))
+    # only the spots of the panels that are not aggregated are in the sources
+    self.shown_spots,self.rasterized = zip(*[self.__select_spots(n) for n in range(len(self.variables))])
+    self.shown_spots,self.rasterized = list(self.shown_spots),list(self.rasterized)
+
+    source_spots = [bokeh.models.ColumnDataSource(self.__spot_data(n)) for n in range(len(self.variables))]
 
     vmin = 0
-    vmax = numpy.percentile(numpy.hstack([expression_data[key] for key in expression_data]),95)
+    vmax = expression_data.vmax
 
     return source_spots, vmin, vmax
 
+  def __viewport(self,n):
+    s = self.s[n]
+    return (s.x_range.start,s.x_range.end),(s.y_range.start,s.y_range.end),(s.inner_width or s.plot_width,s.inner_height or s.plot_height)
+
+  def __spots_in(self,n,x_range,y_range):
+    spots = self.variable_spots[n]
+    x,y = self.coordinates[spots,0],self.coordinates[spots,1]
+    return spots[(x >= x_range[0])&(x <= x_range[1])&(y >= y_range[0])&(y <= y_range[1])]
+
+  def __select_spots(self,n):
+    # the spots are sent when few enough of them are in view; the view is
+    # padded so that short pans do not reveal missing spots
+    if self.max_spots is None:
+      return self.variable_spots[n],False
+    x_range,y_range,_ = self.__viewport(n)
+    pad_x,pad_y = (x_range[1]-x_range[0])/4,(y_range[1]-y_range[0])/4
+    spots = self.__spots_in(n,(x_range[0]-pad_x,x_range[1]+pad_x),(y_range[0]-pad_y,y_range[1]+pad_y))
+    if len(spots) <= self.max_spots:
+      return spots,False
+    return spots[:0],True
+
+  def __spot_data(self,n):
+    spots = self.shown_spots[n]
+    return {'x': self.coordinates[spots,0],
+            'y': self.coordinates[spots,1],
+            'expression': self.expression_data.expressions[self.spot_indices[spots]],
+            'annotation': self.annotations[spots]}
+
+  def __raster_data(self,n):
+    if not self.rasterized[n]:
+      return {'image': [numpy.full((1,1),numpy.nan,dtype=numpy.float32)],'x': [0],'y': [0],'dw': [0],'dh': [0]}
+
+    # one pixel per pixel_size screen pixels over the visible ranges
+    x_range,y_range,(width,height) = self.__viewport(n)
+    shape = (max(1,int(numpy.ceil(height/self.pixel_size))),max(1,int(numpy.ceil(width/self.pixel_size))))
+    spots = self.__spots_in(n,x_range,y_range)
+    with metrics.timer('spav_view_seconds',view=type(self).__name__,operation='aggregate'):
+      image = aggregate_spots(self.coordinates[spots,0],self.coordinates[spots,1],
+                              self.expression_data.expressions[self.spot_indices[spots]],
+                              x_range,y_range,shape,self.aggregation)
+
+    return {'image': [image],'x': [x_range[0]],'y': [y_range[0]],'dw': [x_range[1]-x_range[0]],'dh': [y_range[1]-y_range[0]]}
+
+  def __update_panel(self,n):
+    spots,rasterized = self.__select_spots(n)
+    if not numpy.array_equal(spots,self.shown_spots[n]):
+      self.shown_spots[n] = spots
+      self.source_spots[n].data = self.__spot_data(n)
+
+    if rasterized or self.rasterized[n]:
+      self.rasterized[n] = rasterized
+      self.source_raster[n].data = self.__raster_data(n)
+
+    self.spots[n].visible = not rasterized
+    self.rasters[n].visible = rasterized
+
+  def __update_viewport(self,n,attr,old,new):
+    document = self.layout.document
+    if document is None:
+      self.__update_panel(n)
+      return
+
+    if n not in self.__pending:
+      self.__pending.add(n)
+      document.add_next_tick_callback(functools.partial(self.__update_pending,n))
+
+  def __update_pending(self,n):
+    self.__pending.discard(n)
+    with hold_document(self.layout.document,type(self).__name__):
+      self.__update_panel(n)
+
+  def __update_aggregation(self,attr,old,new):
+    self.aggregation = self.AGGREGATIONS[new]
+
+    with hold_document(self.layout.document,type(self).__name__):
+      for n in range(len(self.variables)):
+        if self.rasterized[n]:
+          self.source_raster[n].data = self.__raster_data(n)
+
   def __update_plot_gene(self,attr,old,new):
-    if new not in self.genes:
+    if new not in self.gene_index:
       self.error_pretext.text = '<b>Gene not found!</b>'
       return
-    self.gene = new
-    self.error_pretext.text = ''
-
-    self.textinput_gene.disabled = True
     self.error_pretext.text = '<b>Please wait.</b>'
 
-    source_spots,self.vmin,self.vmax = self.__create_source_spots(self.gene)
+    self.gene_loader.request(new,self.layout.document)
 
-    for idx in range(0,len(source_spots)):
-      self.source_spots[idx].data = source_spots[idx].data
+  def __apply_gene(self,gene,expression_data):
+    self.gene = gene
+    self.vmin,self.vmax = 0,expression_data.vmax
 
-    self.color_mapper.low = self.vmin
-    self.color_mapper.high = self.vmax
+    with hold_document(self.layout.document,type(self).__name__):
+      self.expression_data = expression_data
+      for n in range(len(self.variables)):
+        self.source_spots[n].data['expression'] = expression_data.expressions[self.spot_indices[self.shown_spots[n]]]
+        if self.rasterized[n]:
+          self.source_raster[n].data = self.__raster_data(n)
 
-    self.textinput_gene.disabled = False
-    self.error_pretext.text = ''
+      self.color_mapper.low = self.vmin
+      self.color_mapper.high = self.vmax
+
+      self.error_pretext.text = ''
+
+  def __fail_gene(self,gene,exception):
+    self.error_pretext.text = '<b>Loading failed!</b>'
 
   def __update_spot_size(self,attr,old,new):
     for spots_idx in range(0,len(self.spots)):
@@ -651,10 +972,11 @@ class ExpressionInCommonCoordinate:
   
     plots.append([self.textinput_gene])
     plots.append([self.error_pretext])
-    plots.append([self.slider])
+    plots.append([self.slider,self.radiobuttongroup_aggregation])
 
     subplots = []
     self.spots = []
+    self.rasters = []
     for n,key in enumerate(self.variables):
 
       if n > 0 and n%self.n_columns == 0:
@@ -664,12 +986,16 @@ class ExpressionInCommonCoordinate:
       
       spots = self.s[n].scatter(x='x',y='y',radius=self.slider.value,
                                 fill_color={'field': 'expression','transform': self.color_mapper},
-                                fill_alpha=0.8,line_color=None,source=self.source_spots[n])
+                                fill_alpha=0.8,line_color=None,source=self.source_spots[n],
+                                visible=not self.rasterized[n])
+      rasters = self.s[n].image(image='image',x='x',y='y',dw='dw',dh='dh',color_mapper=self.color_mapper,
+                                source=self.source_raster[n],visible=self.rasterized[n])
   
-      hover = bokeh.models.HoverTool(tooltips=[('Expression','@expression'),('Annotation','@annotation')],renderers=[spots])
+      hover = create_spot_hover(self.dataset.annotation_names,[spots])
       self.s[n].add_tools(hover)
 
       self.spots.append(spots)
+      self.rasters.append(rasters)
 
       subplots.append(self.s[n])
   
@@ -692,34 +1018,46 @@ class ExpressionInCommonCoordinate:
     return plots
 
 class AARExpressionCoefficients:
-  def __init__(self,data_filename,gene=None,n_columns=4,height=250):
-    self.filename = data_filename 
-    self.genes = self.__read_genes()
-    self.evaluation_points,self.variables,self.aars = self.__read_data()
+  def __init__(self,data_filename,gene=None,n_columns=4,height=250,n_points=200):
+    self.dataset = get_dataset(data_filename)
+    self.filename = self.dataset.filename
+    self.genes = self.dataset.genes
+    self.gene_index = self.dataset.gene_index
+    self.density_limits,self.variables,self.aars = self.dataset.density_limits,self.dataset.beta_variables,self.dataset.aar_names
 
     self.n_columns = n_columns
     self.height = height
+    self.n_points = n_points
 
     if gene is None:
       self.gene = self.genes[0]
     else:
       self.gene = gene
 
-    self.source,max_value = self.__create_source(self.gene)
+    self.density_data = self.dataset.get_density(self.gene)
+    density_columns,max_value = create_density_columns(self.density_data,len(self.variables),len(self.aars),self.density_limits,self.n_points)
+    # one source shared by all the figures; the densities of the (variable,aar)
+    # pairs are the columns and the baseline of the areas is a scalar
+    self.source = bokeh.models.ColumnDataSource(density_columns)
+    self.x_range = bokeh.models.Range1d(*self.density_limits)
+    self.y_range = bokeh.models.Range1d(0,max_value)
 
-    self.textinput_gene = AutocompleteInputCustom(value=self.gene,title='Gene:',completions=self.genes,width=300)
+    self.textinput_gene = create_gene_input(self.dataset,self.gene,'density')
     self.textinput_gene.on_change('value',self.__update_plot)
     self.error_pretext = bokeh.models.widgets.Div(text='',width=125,height=20)
 
-    self.rangeslider_limits = bokeh.models.widgets.RangeSlider(start=self.evaluation_points.min(),end=self.evaluation_points.max(),step=0.25,
-                                                               value=(self.evaluation_points.min(),self.evaluation_points.max()),title='X-axis range',width=300)
+    self.gene_loader = GeneLoader(self.dataset.get_density,self.__apply_gene,self.__fail_gene,type(self).__name__)
+
+    self.rangeslider_limits = bokeh.models.widgets.RangeSlider(start=self.density_limits[0],end=self.density_limits[1],step=0.25,
+                                                               value=self.density_limits,title='X-axis range',width=300)
     self.rangeslider_limits.on_change('value',self.__update_xaxislimits)
+    self.rangeslider_limits.on_change('value_throttled',self.__update_resolution)
 
     self.s = []
     for variable in self.variables:
       # TODO: https://github.com/bokeh/bokeh/issues/9182
-      #s = bokeh.plotting.figure(x_range=(self.evaluation_points.min(),self.evaluation_points.max()),y_range=(0,max_value),title=variable,tools=[bokeh.models.HoverTool(tooltips=[('AAR', '@label')])],y_axis_label='Posterior probability density',x_axis_label='Coefficient, β')
-      s = bokeh.plotting.figure(plot_height=self.height,x_range=(self.evaluation_points.min(),self.evaluation_points.max()),y_range=(0,max_value),title=variable,tools='',y_axis_label='Posterior probability density',x_axis_label='Coefficient, β')
+      #s = bokeh.plotting.figure(x_range=self.density_limits,y_range=(0,max_value),title=variable,tools=[bokeh.models.HoverTool(tooltips=[('AAR', '@label')])],y_axis_label='Posterior probability density',x_axis_label='Coefficient, β')
+      s = bokeh.plotting.figure(plot_height=self.height,x_range=self.x_range,y_range=self.y_range,title=variable,tools='',y_axis_label='Posterior probability density',x_axis_label='Coefficient, β')
 
       s.grid.grid_line_alpha = 0.2
       s.xgrid.visible = True
@@ -732,63 +1070,39 @@ class AARExpressionCoefficients:
 
     self.layout = bokeh.layouts.layout([bokeh.layouts.layout(self.__plots[0:3]),bokeh.layouts.gridplot(self.__plots[3:],merge_tools=True,toolbar_location='left',toolbar_options=dict(logo=None),sizing_mode='stretch_width')],sizing_mode='stretch_width')
 
-  def __read_genes(self):
-    with h5py.File(self.filename,'r') as f:
-      genes = list(map(lambda x: x.decode('UTF-8'),list(f['genes'])))
-
-    return genes
-
-  def __read_data(self):
-    with h5py.File(self.filename,'r') as f:
-      density_evaluation_points = numpy.array(f['beta']['density_evaluation_points'])
-      variables = list(map(lambda x: x.decode('UTF-8'),list(f['beta']['beta_variables'])))
-      aar_names = list(map(lambda x: x.decode('UTF-8'),list(f['beta']['aar_names'])))
-    return density_evaluation_points,variables,aar_names
-
-  def __create_source(self,gene):
-    source = {}
-    for variable in self.variables:
-      source[variable] = {}
-      for aar in self.aars:
-        source[variable][aar] = bokeh.models.ColumnDataSource({'x': self.evaluation_points,'label':len(self.evaluation_points)*[aar]})
-
-    with h5py.File(self.filename,'r') as f:
-      tmp = numpy.array(f['beta']['density'][gene])
-
-    max_value = numpy.max(tmp)*1.2
-
-    for variable_idx,variable in enumerate(self.variables):
-      for aar_idx,aar in enumerate(self.aars):
-        source[variable][aar].add(numpy.zeros(tmp.shape[0]),'y1')
-        source[variable][aar].add(tmp[:,variable_idx,aar_idx],'y2')
-
-    return source,max_value
-
   def __update_plot(self,attr,old,new):
-    if new not in self.genes:
+    if new not in self.gene_index:
       self.error_pretext.text = '<b>Gene not found!</b>'
       return
-    self.gene = new
-    self.error_pretext.text = ''
-
     self.error_pretext.text = '<b>Please wait.</b>'
-    self.textinput_gene.disabled = True
 
-    source,max_value = self.__create_source(self.gene)
+    self.gene_loader.request(new,self.layout.document)
 
-    for variable_idx,variable in enumerate(self.variables):
-      for aar in self.aars:
-        self.source[variable][aar].data = source[variable][aar].data
-      self.s[variable_idx].y_range.start = 0
-      self.s[variable_idx].y_range.end = max_value
+  def __apply_gene(self,gene,density_data):
+    self.gene = gene
+    self.density_data = density_data
+
+    with metrics.timer('spav_view_seconds',view=type(self).__name__,operation='columns'):
+      density_columns,max_value = create_density_columns(self.density_data,len(self.variables),len(self.aars),
+                                                         self.rangeslider_limits.value,self.n_points)
+
+    with hold_document(self.layout.document,type(self).__name__):
+      self.source.data.update(density_columns)
+      self.y_range.start = 0
+      self.y_range.end = max_value
+
+      self.error_pretext.text = ''
 
-    self.textinput_gene.disabled = False
-    self.error_pretext.text = ''
+  def __fail_gene(self,gene,exception):
+    self.error_pretext.text = '<b>Loading failed!</b>'
 
   def __update_xaxislimits(self,attr,old,new):
-    for variable_idx in range(0,len(self.variables)):
-      self.s[variable_idx].x_range.start = new[0]
-      self.s[variable_idx].x_range.end = new[1]
+    self.x_range.start = new[0]
+    self.x_range.end = new[1]
+
+  def __update_resolution(self,attr,old,new):
+    density_columns,_ = create_density_columns(self.density_data,len(self.variables),len(self.aars),new,self.n_points)
+    self.source.data.update(density_columns)
 
   def __plot(self):
     hsv = [(x*1.0/len(self.aars),0.5,0.5) for x in range(len(self.aars))]
@@ -807,7 +1121,7 @@ class AARExpressionCoefficients:
         plots.append(subplots)
         subplots = []
       for aar_idx,aar in enumerate(self.aars):
-        self.s[variable_idx].varea('x','y1','y2',fill_color=palette[aar_idx],alpha=0.4,source=self.source[variable][aar],legend=aar)
+        self.s[variable_idx].varea(x=density_points_column(variable_idx,aar_idx),y1=0,y2=density_column(variable_idx,aar_idx),fill_color=palette[aar_idx],alpha=0.4,source=self.source,legend=aar)
         self.s[variable_idx].legend.click_policy='hide'
 
         # TODO: make sure this generalizes
@@ -829,34 +1143,46 @@ class AARExpressionCoefficients:
     return plots
 
 class LevelExpressionCoefficients:
-  def __init__(self,data_filename,gene=None,n_columns=4,height=250):
-    self.filename = data_filename 
-    self.genes = self.__read_genes()
-    self.evaluation_points,self.variables,self.aars = self.__read_data()
+  def __init__(self,data_filename,gene=None,n_columns=4,height=250,n_points=200):
+    self.dataset = get_dataset(data_filename)
+    self.filename = self.dataset.filename
+    self.genes = self.dataset.genes
+    self.gene_index = self.dataset.gene_index
+    self.density_limits,self.variables,self.aars = self.dataset.density_limits,self.dataset.beta_variables,self.dataset.aar_names
 
     self.n_columns = n_columns
     self.height = height
+    self.n_points = n_points
 
     if gene is None:
       self.gene = self.genes[0]
     else:
       self.gene = gene
 
-    self.source,max_value = self.__create_source(self.gene)
+    self.density_data = self.dataset.get_density(self.gene)
+    density_columns,max_value = create_density_columns(self.density_data,len(self.variables),len(self.aars),self.density_limits,self.n_points)
+    # one source shared by all the figures; the densities of the (variable,aar)
+    # pairs are the columns and the baseline of the areas is a scalar
+    self.source = bokeh.models.ColumnDataSource(density_columns)
+    self.x_range = bokeh.models.Range1d(*self.density_limits)
+    self.y_range = bokeh.models.Range1d(0,max_value)
 
-    self.textinput_gene = AutocompleteInputCustom(value=self.gene,title='Gene:',completions=self.genes,width=300)
+    self.textinput_gene = create_gene_input(self.dataset,self.gene,'density')
     self.textinput_gene.on_change('value',self.__update_plot)
     self.error_pretext = bokeh.models.widgets.Div(text='',width=125,height=20)
 
-    self.rangeslider_limits = bokeh.models.widgets.RangeSlider(start=self.evaluation_points.min(),end=self.evaluation_points.max(),step=0.25,
-                                                               value=(self.evaluation_points.min(),self.evaluation_points.max()),title='X-axis range',width=300)
+    self.gene_loader = GeneLoader(self.dataset.get_density,self.__apply_gene,self.__fail_gene,type(self).__name__)
+
+    self.rangeslider_limits = bokeh.models.widgets.RangeSlider(start=self.density_limits[0],end=self.density_limits[1],step=0.25,
+                                                               value=self.density_limits,title='X-axis range',width=300)
     self.rangeslider_limits.on_change('value',self.__update_xaxislimits)
+    self.rangeslider_limits.on_change('value_throttled',self.__update_resolution)
 
     self.s = []
     for aar in self.aars:
       # TODO: https://github.com/bokeh/bokeh/issues/9182
-      #s = bokeh.plotting.figure(x_range=(self.evaluation_points.min(),self.evaluation_points.max()),y_range=(0,max_value),title=variable,tools=[bokeh.models.HoverTool(tooltips=[('AAR', '@label')])],y_axis_label='Posterior probability density',x_axis_label='Coefficient, β')
-      s = bokeh.plotting.figure(plot_height=self.height,x_range=(self.evaluation_points.min(),self.evaluation_points.max()),y_range=(0,max_value),title=aar,tools='',y_axis_label='Posterior probability density',x_axis_label='Coefficient, β')
+      #s = bokeh.plotting.figure(x_range=self.density_limits,y_range=(0,max_value),title=variable,tools=[bokeh.models.HoverTool(tooltips=[('AAR', '@label')])],y_axis_label='Posterior probability density',x_axis_label='Coefficient, β')
+      s = bokeh.plotting.figure(plot_height=self.height,x_range=self.x_range,y_range=self.y_range,title=aar,tools='',y_axis_label='Posterior probability density',x_axis_label='Coefficient, β')
 
       s.grid.grid_line_alpha = 0.2
       s.xgrid.visible = True
@@ -869,63 +1195,39 @@ class LevelExpressionCoefficients:
 
     self.layout = bokeh.layouts.layout([bokeh.layouts.layout(self.__plots[0:3]),bokeh.layouts.gridplot(self.__plots[3:],merge_tools=True,toolbar_location='left',toolbar_options=dict(logo=None),sizing_mode='stretch_width')],sizing_mode='stretch_width')
 
-  def __read_genes(self):
-    with h5py.File(self.filename,'r') as f:
-      genes = list(map(lambda x: x.decode('UTF-8'),list(f['genes'])))
-
-    return genes
-
-  def __read_data(self):
-    with h5py.File(self.filename,'r') as f:
-      density_evaluation_points = numpy.array(f['beta']['density_evaluation_points'])
-      variables = list(map(lambda x: x.decode('UTF-8'),list(f['beta']['beta_variables'])))
-      aar_names = list(map(lambda x: x.decode('UTF-8'),list(f['beta']['aar_names'])))
-    return density_evaluation_points,variables,aar_names
-
-  def __create_source(self,gene):
-    source = {}
-    for variable in self.variables:
-      source[variable] = {}
-      for aar in self.aars:
-        source[variable][aar] = bokeh.models.ColumnDataSource({'x': self.evaluation_points,'label':len(self.evaluation_points)*[variable]})
-
-    with h5py.File(self.filename,'r') as f:
-      tmp = numpy.array(f['beta']['density'][gene])
-
-    max_value = numpy.max(tmp)*1.2
-
-    for variable_idx,variable in enumerate(self.variables):
-      for aar_idx,aar in enumerate(self.aars):
-        source[variable][aar].add(numpy.zeros(tmp.shape[0]),'y1')
-        source[variable][aar].add(tmp[:,variable_idx,aar_idx],'y2')
-
-    return source,max_value
-
   def __update_plot(self,attr,old,new):
-    if new not in self.genes:
+    if new not in self.gene_index:
       self.error_pretext.text = '<b>Gene not found!</b>'
       return
-    self.gene = new
-    self.error_pretext.text = ''
-
     self.error_pretext.text = '<b>Please wait.</b>'
-    self.textinput_gene.disabled = True
 
-    source,max_value = self.__create_source(self.gene)
+    self.gene_loader.request(new,self.layout.document)
 
-    for aar_idx,aar in enumerate(self.aars):
-      for variable in self.variables:
-        self.source[variable][aar].data = source[variable][aar].data
-      self.s[aar_idx].y_range.start = 0
-      self.s[aar_idx].y_range.end = max_value
+  def __apply_gene(self,gene,density_data):
+    self.gene = gene
+    self.density_data = density_data
+
+    with metrics.timer('spav_view_seconds',view=type(self).__name__,operation='columns'):
+      density_columns,max_value = create_density_columns(self.density_data,len(self.variables),len(self.aars),
+                                                         self.rangeslider_limits.value,self.n_points)
 
-    self.textinput_gene.disabled = False
-    self.error_pretext.text = ''
+    with hold_document(self.layout.document,type(self).__name__):
+      self.source.data.update(density_columns)
+      self.y_range.start = 0
+      self.y_range.end = max_value
+
+      self.error_pretext.text = ''
+
+  def __fail_gene(self,gene,exception):
+    self.error_pretext.text = '<b>Loading failed!</b>'
 
   def __update_xaxislimits(self,attr,old,new):
-    for aar_idx in range(0,len(self.aars)):
-      self.s[aar_idx].x_range.start = new[0]
-      self.s[aar_idx].x_range.end = new[1]
+    self.x_range.start = new[0]
+    self.x_range.end = new[1]
+
+  def __update_resolution(self,attr,old,new):
+    density_columns,_ = create_density_columns(self.density_data,len(self.variables),len(self.aars),new,self.n_points)
+    self.source.data.update(density_columns)
 
   def __plot(self):
     hsv = [(x*1.0/len(self.variables),0.5,0.5) for x in range(len(self.variables))]
@@ -944,7 +1246,7 @@ class LevelExpressionCoefficients:
         plots.append(subplots)
         subplots = []
       for variable_idx,variable in enumerate(self.variables):
-        self.s[aar_idx].varea('x','y1','y2',fill_color=palette[variable_idx],alpha=0.4,source=self.source[variable][aar],legend=variable)
+        self.s[aar_idx].varea(x=density_points_column(variable_idx,aar_idx),y1=0,y2=density_column(variable_idx,aar_idx),fill_color=palette[variable_idx],alpha=0.4,source=self.source,legend=variable)
         self.s[aar_idx].legend.click_policy='hide'
 
         # TODO: make sure this generalizes
@@ -0,0 +1,53 @@
+import os
+import sys
+import importlib.util
+import importlib.machinery
+
+import pytest
+
+REPOSITORY = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+def load_prepare_script():
+  filename = os.path.join(REPOSITORY,'bin','spav_prepare_data')
+  loader = importlib.machinery.SourceFileLoader('spav_prepare_data',filename)
+  module = importlib.util.module_from_spec(importlib.util.spec_from_loader(loader.name,loader))
+  sys.modules[loader.name] = module
+  loader.exec_module(module)
+  return module
+
+def prepare(dataset_directory,server_directory,jobs=1):
+  prepare = load_prepare_script()
+  # the paths in the metadata are relative to the dataset directory
+  working_directory = os.getcwd()
+  os.chdir(dataset_directory)
+  try:
+    prepare.generate_data_files('data','output',server_directory,copy=True,jobs=jobs)
+  finally:
+    os.chdir(working_directory)
+
+@pytest.fixture(scope='session')
+def dataset_directory(tmp_path_factory):
+  # a small synthetic dataset (spav_prepare_data needs splotch)
+  pytest.importorskip('splotch.utils')
+  sys.path.insert(0,os.path.join(REPOSITORY,'benchmarks'))
+  from synthetic_data import generate_dataset
+
+  dataset_directory = str(tmp_path_factory.mktemp('dataset'))
+  generate_dataset(dataset_directory,n_genes=5,n_arrays=2,n_spots=60,n_draws=20,n_aars=2,image_size=600)
+
+  return dataset_directory
+
+@pytest.fixture(scope='session')
+def server_directory(dataset_directory,tmp_path_factory):
+  server_directory = str(tmp_path_factory.mktemp('server'))
+  prepare(dataset_directory,server_directory)
+
+  return server_directory
+
+@pytest.fixture
+def dataset(server_directory):
+  from spav.data import Dataset
+
+  dataset = Dataset(os.path.join(server_directory,'data','data.hdf5'))
+  yield dataset
+  dataset.close()
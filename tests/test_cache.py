@@ -0,0 +1,65 @@
+import time
+import threading
+
+import numpy
+import pytest
+
+from spav.data import LRUCache, resident_nbytes
+
+class Entry:
+  def __init__(self,key,nbytes=1):
+    self.key = key
+    self.nbytes = nbytes
+
+def test_eviction():
+  cache = LRUCache(2)
+  for key in ['a','b','a','c']:
+    cache.get(key,Entry)
+
+  assert 'a' in cache and 'c' in cache and 'b' not in cache
+  assert cache.stats()['evictions'] == 1
+
+def test_concurrent_loads_are_shared():
+  cache = LRUCache(10)
+  started = threading.Event()
+  loads = []
+
+  def load(key):
+    loads.append(key)
+    started.set()
+    time.sleep(0.1)
+    return Entry(key)
+
+  results = []
+  first = threading.Thread(target=lambda: results.append(cache.get('a',load)))
+  first.start()
+  started.wait()
+  # the entry is being loaded, so the second reader waits for the first load
+  assert 'a' in cache
+  second = cache.get('a',load)
+  first.join()
+
+  assert loads == ['a']
+  assert second is results[0]
+  assert cache.stats()['waits'] == 1
+
+def test_failed_loads_are_not_cached():
+  cache = LRUCache(10)
+
+  def fail(key):
+    raise ValueError(key)
+
+  with pytest.raises(ValueError):
+    cache.get('a',fail)
+
+  assert 'a' not in cache
+  assert cache.get('a',Entry).key == 'a'
+
+def test_resident_nbytes(tmp_path):
+  values = numpy.arange(100,dtype=numpy.float32)
+  values.tofile(str(tmp_path/'values'))
+  memory_map = numpy.memmap(str(tmp_path/'values'),mode='r',dtype=numpy.float32,shape=(100,))
+
+  assert resident_nbytes(values) == 400
+  assert resident_nbytes(numpy.asarray(memory_map[10:20])) == 0
+  assert resident_nbytes(memory_map[10:20]*2) == 40
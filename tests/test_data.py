@@ -0,0 +1,33 @@
+import h5py
+import numpy
+import pytest
+
+from spav.data import read_tiles, read_thumbnail
+
+@pytest.fixture
+def image_grp(tmp_path):
+  with h5py.File(str(tmp_path/'data.hdf5'),'w') as f:
+    yield f.create_group('image')
+
+def test_thumbnail(image_grp):
+  image_grp.create_dataset('thumbnail_filename',data='thumbnails/512/array_0.jpg')
+  image_grp.create_dataset('thumbnail_scale',data=numpy.array([0.25,0.25]))
+
+  thumbnail = read_thumbnail(image_grp)
+
+  assert thumbnail['filename'] == 'thumbnails/512/array_0.jpg'
+  assert isinstance(thumbnail['filename'],str)
+  assert tuple(thumbnail['scale']) == (0.25,0.25)
+
+def test_without_thumbnail(image_grp):
+  assert read_thumbnail(image_grp) is None
+
+def test_tiles(image_grp):
+  image_grp.create_dataset('tile_directory',data='tiles/256/array_0')
+  image_grp.create_dataset('tile_size',data=256)
+  image_grp.create_dataset('tile_levels',data=4)
+
+  assert read_tiles(image_grp) == {'directory': 'tiles/256/array_0','tile_size': 256,'n_levels': 4}
+
+def test_without_tiles(image_grp):
+  assert read_tiles(image_grp) is None
@@ -0,0 +1,98 @@
+import numpy
+import pytest
+
+scipy_stats = pytest.importorskip('scipy.stats')
+
+from spav.density import gaussian_kde, gaussian_kde_on_supports, density_supports, support_points, interpolate_density
+
+def scipy_densities(samples,points):
+  samples = samples.reshape(samples.shape[0],-1)
+  return numpy.stack([scipy_stats.gaussian_kde(samples[:,column]).evaluate(points) for column in range(samples.shape[1])],axis=1)
+
+def assert_close(densities,expected,rtol=1e-3):
+  # the tolerance is relative to the peak of each column
+  scale = expected.max(0,keepdims=True)
+  assert numpy.all(numpy.abs(densities-expected) <= rtol*scale)
+
+@pytest.fixture
+def random_state():
+  return numpy.random.RandomState(0)
+
+def test_normal(random_state):
+  samples = random_state.normal(0,1,(1000,3,4))
+  points = numpy.linspace(-10,10,256)
+
+  densities = gaussian_kde(samples,points)
+
+  assert densities.shape == (256,3,4)
+  assert_close(densities.reshape(256,-1),scipy_densities(samples,points))
+
+def test_mixed_columns(random_state):
+  # wide, skewed, shifted, and narrow posteriors of the same gene
+  samples = numpy.stack([random_state.normal(0,3,2000),
+                         random_state.gamma(1.5,0.5,2000),
+                         random_state.lognormal(0,0.75,2000)-2,
+                         random_state.normal(1,0.01,2000)],axis=1)
+  points = numpy.linspace(-10,10,500)
+
+  assert_close(gaussian_kde(samples,points),scipy_densities(samples,points))
+
+def test_supports(random_state):
+  # a wide posterior does not stretch the support of a narrow one
+  samples = numpy.stack([random_state.normal(0.5,0.05,1000),random_state.normal(-2,3,1000),
+                         numpy.full(1000,20.0)],axis=1)
+
+  supports = density_supports(samples,(-10,10))
+
+  assert supports.shape == (3,2)
+  assert 0 < supports[0,1]-supports[0,0] < 1
+  assert supports[1,0] == -10
+  assert tuple(supports[2]) == (9,10)
+
+def test_densities_on_supports(random_state):
+  samples = numpy.stack([random_state.normal(0.5,0.05,(500,2)),random_state.normal(-2,3,(500,2)),
+                         random_state.gamma(1.5,0.2,(500,2))],axis=1)
+  supports = density_supports(samples)
+
+  densities = gaussian_kde_on_supports(samples,supports,256)
+  points = support_points(supports,256)
+
+  assert densities.shape == points.shape == (256,3,2)
+  for variable_idx in range(3):
+    for aar_idx in range(2):
+      expected = scipy_stats.gaussian_kde(samples[:,variable_idx,aar_idx]).evaluate(points[:,variable_idx,aar_idx])
+      assert_close(densities[:,variable_idx,aar_idx,None],expected[:,None])
+
+def test_interpolated_densities(random_state):
+  # the densities resampled over a zoomed range are as accurate as the stored ones
+  samples = numpy.stack([random_state.normal(0.5,0.05,2000),random_state.gamma(1.5,0.2,2000),
+                         random_state.normal(-2,3,2000)],axis=1)
+  supports = density_supports(samples)
+  densities = gaussian_kde_on_supports(samples,supports,256)
+  points = support_points(supports,256)
+
+  for column in range(3):
+    for start,end in [(0,255),(100,110)]:
+      x = numpy.linspace(points[start,column],points[end,column],200)
+      expected = scipy_stats.gaussian_kde(samples[:,column]).evaluate(x)
+      scale = scipy_stats.gaussian_kde(samples[:,column]).evaluate(points[:,column]).max()
+      assert numpy.all(numpy.abs(interpolate_density(points[:,column],densities[:,column],x)-expected) <= 1e-3*scale)
+
+def test_interpolation_outside_points():
+  assert list(interpolate_density([0,1,2],[0,1,0],[-1,0,1,2,3])) == [0,0,1,0,0]
+
+def test_uneven_points(random_state):
+  samples = random_state.normal(0,1,(500,2))
+  points = numpy.sort(random_state.uniform(-4,4,100))
+
+  assert_close(gaussian_kde(samples,points),scipy_densities(samples,points),rtol=1e-10)
+
+def test_degenerate_column(random_state):
+  # scipy cannot estimate the density of constant samples; their density is zero
+  samples = numpy.stack([numpy.full(500,2.0),random_state.normal(0,1,500)],axis=1)
+  points = numpy.linspace(-10,10,256)
+
+  densities = gaussian_kde(samples,points)
+
+  assert numpy.all(densities[:,0] == 0)
+  assert_close(densities[:,1:],scipy_densities(samples[:,1:],points))
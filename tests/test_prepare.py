@@ -0,0 +1,15 @@
+import os
+
+import h5py
+import numpy
+
+from conftest import prepare
+
+def test_parallel_prepare(dataset_directory,server_directory,tmp_path):
+  # the genes are written in the same order whatever the number of processes
+  prepare(dataset_directory,str(tmp_path),jobs=2)
+
+  with h5py.File(os.path.join(server_directory,'data','data.hdf5'),'r') as serial, \
+       h5py.File(str(tmp_path/'data'/'data.hdf5'),'r') as parallel:
+    for key in ['expressions','beta/density','beta/support','summary/lambda']:
+      assert numpy.array_equal(serial[key][()],parallel[key][()])
@@ -0,0 +1,32 @@
+import os
+import xml.etree.ElementTree
+
+import pytest
+from PIL import Image
+
+from spav.render import Renderer, VIEWS
+
+@pytest.fixture
+def renderer(server_directory):
+  renderer = Renderer(os.path.join(server_directory,'data','data.hdf5'),os.path.join(server_directory,'static'),panel_width=100)
+  yield renderer
+  renderer.close()
+
+@pytest.mark.parametrize('view',VIEWS)
+def test_png(renderer,view,tmp_path):
+  filename = str(tmp_path/'gene.png')
+  renderer.render(renderer.dataset.genes[0],view,filename,'png')
+
+  with Image.open(filename) as image:
+    assert image.format == 'PNG'
+    assert image.size[0] > 100
+
+@pytest.mark.parametrize('view',VIEWS)
+def test_svg(renderer,view,tmp_path):
+  filename = str(tmp_path/'gene.svg')
+  renderer.render(renderer.dataset.genes[0],view,filename,'svg')
+
+  root = xml.etree.ElementTree.parse(filename).getroot()
+  texts = [element.text for element in root.iter('{http://www.w3.org/2000/svg}text')]
+  assert renderer.dataset.genes[0] in texts
+  assert len(list(root.iter('{http://www.w3.org/2000/svg}circle'))) > 0
@@ -0,0 +1,22 @@
+from spav.search import GeneSearchIndex
+
+def test_empty_query():
+  assert GeneSearchIndex(['Actb','Gfap']).search('') == []
+
+def test_unmatched_query():
+  assert GeneSearchIndex(['Actb','Gfap']).search('xyz') == []
+
+def test_prefixes_before_substrings():
+  assert GeneSearchIndex(['Gfap','Actb','Bact1']).search('act') == ['Actb','Bact1']
+
+def test_names_differing_in_case():
+  index = GeneSearchIndex(['Actb','ACTB','Actg1'])
+
+  assert index.search('act') == ['Actb','ACTB','Actg1']
+  assert index.search('ACT',limit=1) == ['Actb']
+
+def test_aliases():
+  index = GeneSearchIndex(['Actb','Gfap'],{'beta-actin': 'Actb','actb': 'Actb'})
+
+  assert index.search('beta') == ['Actb']
+  assert index.search('actb') == ['Actb']
@@ -0,0 +1,40 @@
+import os
+
+import pytest
+from bokeh.document import Document
+
+import spav.utils
+
+VIEWS = {'ExpressionOnArrays': lambda dataset,static_directory: spav.utils.ExpressionOnArrays(dataset,static_directory),
+         'ExpressionOnArray': lambda dataset,static_directory: spav.utils.ExpressionOnArray(dataset,static_directory),
+         'ExpressionInCommonCoordinate': lambda dataset,static_directory: spav.utils.ExpressionInCommonCoordinate(dataset),
+         'AARExpressionCoefficients': lambda dataset,static_directory: spav.utils.AARExpressionCoefficients(dataset),
+         'LevelExpressionCoefficients': lambda dataset,static_directory: spav.utils.LevelExpressionCoefficients(dataset)}
+
+def test_array_data(dataset):
+  for data in dataset.arrays.values():
+    assert isinstance(data['title'],str)
+    assert isinstance(data['filename'],str)
+
+@pytest.mark.parametrize('view_name',VIEWS)
+def test_views(dataset,view_name):
+  view = VIEWS[view_name](dataset,os.path.join('static',dataset.static_subdirectory))
+  document = Document()
+  document.add_root(view.layout)
+  document.to_json_string()
+
+  view.textinput_gene.value = dataset.genes[1]
+  assert view.gene == dataset.genes[1]
+
+@pytest.mark.parametrize('view_name',['AARExpressionCoefficients','LevelExpressionCoefficients'])
+def test_density_resampling(dataset,view_name):
+  view = VIEWS[view_name](dataset,None)
+  document = Document()
+  document.add_root(view.layout)
+
+  view.rangeslider_limits.value_throttled = (0,0.5)
+
+  for column,values in view.source.data.items():
+    assert len(values) == view.n_points
+    if column.startswith('points_'):
+      assert values.min() >= 0 and values.max() <= 0.5